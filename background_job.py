@@ -0,0 +1,90 @@
+"""
+Run long image processing off the Tk main thread.
+
+The work function runs on a worker thread and reports progress through
+job.progress(message). Messages are queued and picked up by the Tk loop with
+after() polling, so all callbacks run on the main thread and may touch widgets.
+job.progress() is also the cancellation point: after cancel() the next call
+raises JobCancelled, which stops the work between two stages.
+"""
+import queue
+import threading
+
+
+class JobCancelled(Exception):
+    """Raised inside the worker when the job was cancelled."""
+
+
+class BackgroundJob:
+    def __init__(self, root, target, on_progress=None, on_done=None, on_error=None,
+                 on_cancelled=None, poll_ms=100):
+        """
+        :param root: Tk root (or any widget) used for after() polling
+        :param target: Function called as target(job) on the worker thread, its return value goes to on_done
+        :param on_progress: Called with each progress message
+        :param on_done: Called with the result of target
+        :param on_error: Called with the exception if target raised
+        :param on_cancelled: Called without arguments if the job was cancelled
+        :param poll_ms: Polling interval of the Tk loop in milliseconds
+        """
+        self.root = root
+        self.target = target
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancelled = on_cancelled
+        self.poll_ms = poll_ms
+        self._events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="background-job", daemon=True)
+        self._thread.start()
+        self.root.after(self.poll_ms, self._poll)
+        return self
+
+    def cancel(self):
+        """Request cancellation; the job stops at its next progress() call."""
+        self._cancel.set()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def progress(self, message):
+        """Report a stage from the worker thread. Raises JobCancelled if cancel() was called."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self._events.put(("progress", message))
+
+    def _run(self):
+        try:
+            result = self.target(self)
+        except JobCancelled:
+            self._events.put(("cancelled", None))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._events.put(("error", e))
+        else:
+            self._events.put(("done", result))
+
+    def _poll(self):
+        # Runs on the Tk main thread
+        while True:
+            try:
+                kind, value = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                if self.on_progress:
+                    self.on_progress(value)
+                continue
+
+            callback = {"done": self.on_done, "error": self.on_error, "cancelled": self.on_cancelled}[kind]
+            if callback:
+                callback() if kind == "cancelled" else callback(value)
+            return  # the job has finished, stop polling
+
+        self.root.after(self.poll_ms, self._poll)
@@ -0,0 +1,203 @@
+"""
+Headless batch runner for the porosity analysis.
+
+Runs the same pipeline as the "Process Image" button of metal_porosity_analyzer.py
+on every image of a directory or glob, spread over a pool of worker processes.
+Each worker keeps its own warm rembg session for all of its images.
+
+Example:
+    python batch_porosity.py dataset/ --output-dir output/batch --workers 4
+    python batch_porosity.py "samples/*.tif" --black-tolerance 0.5 --min-cluster-size 30
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from black_sampler import ESTIMATORS
+from structured_report import ARRAY_FORMATS
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+
+def collect_inputs(patterns, extensions=IMAGE_EXTENSIONS):
+    """
+    Expand directories and glob patterns into a sorted list of image paths.
+
+    :param patterns: Directories, glob patterns or file paths
+    :param extensions: Lower-case file extensions to accept
+    :return: List of image file paths
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        paths.extend(p for p in candidates
+                     if os.path.isfile(p) and p.lower().endswith(extensions))
+    return sorted(set(paths))
+
+
+def init_worker(model_name, threads_per_worker):
+    """Pin the ONNX thread count and load the rembg model once per worker process."""
+    # rembg reads OMP_NUM_THREADS when it creates the session; without it every
+    # worker would spin up one thread per core and the workers would fight for them
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads_per_worker))
+
+    import removebg
+    if model_name:
+        removebg.DEFAULT_MODEL = model_name
+    removebg.warm_up(background=False)
+
+
+def tiled_output_extension():
+    """Uncompressed TIFF if tifffile is available, otherwise a raw .npy array."""
+    try:
+        import tifffile  # noqa: F401
+        return ".tif"
+    except ImportError:
+        return ".npy"
+
+
+def analyze_one(input_path, output_dir, black_tolerance, minimum_cluster_size, edge_width, edge_samples, debug,
+                tile_memory_mb=None, black_estimator="mean", array_format="npz", remove_debris=False,
+                max_debris_size=None, pyramid=False):
+    """
+    Analyse one image and write <name>_processed.png, <name>_report.txt, <name>_report_pores.csv
+    and the structured report <name>_report.json (+ .npz / .parquet).
+
+    With tile_memory_mb the image is analysed out-of-core in tiles (see tiled_analysis.py)
+    and the processed image is written as <name>_processed.tif / .npy instead.
+
+    :return: Tuple of (input path, stats dict, seconds spent)
+    """
+    from porosity_pipeline import analyze_porosity, generate_report
+    from pore_metrics import write_pore_table, pore_table_path
+    from structured_report import write_report, json_report_path
+    import instrumentation
+
+    start = time.perf_counter()
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    debug_path = os.path.join(output_dir, f"{name}_debug_mask.png") if debug else None
+
+    if tile_memory_mb:
+        from tiled_analysis import analyze_tiled
+        output_path = os.path.join(output_dir, f"{name}_processed{tiled_output_extension()}")
+        stats, _ = analyze_tiled(input_path, black_tolerance, minimum_cluster_size, edge_width, edge_samples,
+                                 output_path=output_path, memory_budget_mb=tile_memory_mb,
+                                 black_estimator=black_estimator)
+    else:
+        processed_image, _, stats = analyze_porosity(
+            input_path, black_tolerance, minimum_cluster_size, edge_width, edge_samples, debug_path,
+            black_estimator, remove_debris, max_debris_size, pyramid)
+        save_start = instrumentation.mark()
+        with instrumentation.stage("save_image"):
+            processed_image.save(os.path.join(output_dir, f"{name}_processed.png"))
+        if 'timings' in stats:
+            stats = dict(stats, timings=stats['timings'] + instrumentation.records(save_start))
+
+    report_path = os.path.join(output_dir, f"{name}_report.txt")
+    generate_report(report_path, stats)
+    if 'pores' in stats:
+        write_pore_table(pore_table_path(report_path), stats['pores'])
+    parameters = {'black_tolerance': black_tolerance, 'minimum_cluster_size': minimum_cluster_size,
+                  'edge_width': edge_width, 'edge_samples': edge_samples, 'black_estimator': black_estimator,
+                  'remove_debris': remove_debris, 'max_debris_size': max_debris_size, 'pyramid': pyramid}
+    write_report(json_report_path(report_path), stats, parameters, tool="batch_porosity", source=input_path,
+                 array_format=array_format)
+    return input_path, stats, time.perf_counter() - start
+
+
+def run_batch(input_paths, output_dir, black_tolerance=0.6, minimum_cluster_size=25, edge_width=35,
+              edge_samples=120, workers=None, model_name=None, debug=False, tile_memory_mb=None,
+              black_estimator="mean", array_format="npz", remove_debris=False, max_debris_size=None,
+              pyramid=False):
+    """
+    Analyse all images on a process pool.
+
+    :return: List of (input path, stats dict or None, seconds or error message) in completion order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(input_paths)))
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(model_name, threads_per_worker)) as pool:
+        futures = {
+            pool.submit(analyze_one, path, output_dir, black_tolerance, minimum_cluster_size,
+                        edge_width, edge_samples, debug, tile_memory_mb, black_estimator, array_format,
+                        remove_debris, max_debris_size, pyramid): path
+            for path in input_paths
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                path, stats, seconds = future.result()
+                print(f"[{done}/{len(futures)}] {path}: {stats['cluster_amount']} clusters, "
+                      f"density {stats['density']:.2%} ({seconds:.1f}s)")
+                results.append((path, stats, seconds))
+            except Exception as e:
+                print(f"[{done}/{len(futures)}] {path}: failed: {e}", file=sys.stderr)
+                results.append((path, None, str(e)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch porosity analysis without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="Image directories, glob patterns or files")
+    parser.add_argument("-o", "--output-dir", default="output", help="Directory for processed images and reports")
+    parser.add_argument("--black-tolerance", type=float, default=0.6, help="Black tolerance (0.1 - 1.0)")
+    parser.add_argument("--min-cluster-size", type=int, default=25, help="Minimum cluster size in pixels")
+    parser.add_argument("--edge-width", type=int, default=35, help="Protected edge zone width in pixels")
+    parser.add_argument("--edge-samples", type=int, default=120, help="Edge samples for black detection")
+    parser.add_argument("--black-estimator", choices=ESTIMATORS, default="mean",
+                        help="How the border background samples are reduced to the reference black")
+    parser.add_argument("--arrays", choices=ARRAY_FORMATS, default="npz",
+                        help="File format for the per-cluster arrays of the JSON report (parquet needs pyarrow)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--model", default=None, help="rembg model name (default: removebg.DEFAULT_MODEL)")
+    parser.add_argument("--debug", action="store_true", help="Also write the edge zone debug image per input")
+    parser.add_argument("--tile-memory-mb", type=float, default=None,
+                        help="Analyse out-of-core in tiles using about this much memory per worker "
+                             "(for stitched gigapixel images)")
+    parser.add_argument("--remove-debris", action="store_true",
+                        help="Clear the specks around the object in the processed image")
+    parser.add_argument("--max-debris-size", type=int, default=None,
+                        help="With --remove-debris: clear specks smaller than this many pixels "
+                             "(default: everything except the largest object)")
+    parser.add_argument("--pyramid", action="store_true",
+                        help="Search the holes coarse to fine, faster on samples with few pores (same results)")
+    args = parser.parse_args(argv)
+    if args.remove_debris and args.tile_memory_mb:
+        parser.error("--remove-debris does not work with the tiled analysis")
+    if args.pyramid and args.tile_memory_mb:
+        parser.error("--pyramid does not work with the tiled analysis")
+    if args.debug and args.tile_memory_mb:
+        parser.error("--debug does not work with the tiled analysis")
+    if args.max_debris_size is not None and not args.remove_debris:
+        parser.error("--max-debris-size needs --remove-debris")
+
+    # Raw .npy arrays can only be read by the tiled analysis
+    extensions = IMAGE_EXTENSIONS + ('.npy',) if args.tile_memory_mb else IMAGE_EXTENSIONS
+    input_paths = collect_inputs(args.inputs, extensions)
+    if not input_paths:
+        parser.error("no images found")
+
+    start = time.perf_counter()
+    results = run_batch(input_paths, args.output_dir, args.black_tolerance, args.min_cluster_size,
+                        args.edge_width, args.edge_samples, args.workers, args.model, args.debug,
+                        args.tile_memory_mb, args.black_estimator, args.arrays, args.remove_debris,
+                        args.max_debris_size, args.pyramid)
+    failed = sum(1 for _, stats, _ in results if stats is None)
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(results) - failed}/{len(results)} images in {elapsed:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
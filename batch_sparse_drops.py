@@ -0,0 +1,224 @@
+"""
+Headless batch runner for the sparse drops background remover.
+
+Streams every image of a directory or glob through the same steps as the
+"Remove Background" button of sparse_drops.py: decode -> background mask ->
+encode. Decoding and encoding (PNG compression) run on a thread pool while the
+main thread builds the masks, so reading, computing and writing of different
+images overlap. At most a few images are held in memory at any time.
+Next to every output image go the particle report <name>_report.txt, the
+per-particle table <name>_report_particles.csv and <name>_report.json, and
+summary.csv collects one line per image.
+
+Example:
+    python batch_sparse_drops.py "dataset/Bilder zum Freistellen_13_05_25" -o output/freigestellt
+    python batch_sparse_drops.py "samples/*.tif" --aggressiveness 50 --format tif -j 8
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from batch_porosity import IMAGE_EXTENSIONS, collect_inputs
+from histogram_thresholds import auto_thresholds
+from particle_stats import particle_statistics, write_reports
+from sparse_drops import MINIMUM_PARTICLE_SIZE, load_image, background_mask, debris_mask, save_cutout
+
+OUTPUT_FORMATS = ("png", "tif")
+SUMMARY_COLUMNS = ("file", "output", "aggressiveness", "removed_pixels", "total_pixels", "removed_percent",
+                   "particle_count", "coverage_percent", "d50", "seconds")
+
+
+def output_path_for(input_path, output_dir, output_format):
+    """output_dir/<name>.<format> for an input image"""
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"{name}.{output_format}")
+
+
+def _decode(path):
+    with instrumentation.stage("decode"):
+        return load_image(path)
+
+
+def _encode(img_array, mask, output_file, save_options, report_path, stats, parameters, source):
+    with instrumentation.stage("encode"):
+        save_cutout(img_array, mask, output_file, **save_options)
+    if report_path:
+        with instrumentation.stage("write_reports"):
+            write_reports(report_path, stats, parameters, tool="batch_sparse_drops", source=source)
+
+
+def stream_batch(input_paths, output_dir, aggressiveness=None, black_tol=10, workers=None, prefetch=None,
+                 output_format="png", compress_level=6, minimum_particle_size=MINIMUM_PARTICLE_SIZE,
+                 reports=True, remove_debris=False):
+    """
+    Remove the background of all images, overlapping file I/O with the mask computation.
+
+    The decodes of the next images are queued on the pool while the current mask is
+    built; the finished image is handed to the pool for encoding. prefetch limits
+    both the queued decodes and the pending encodes, which bounds the memory to
+    about 2 * prefetch images.
+
+    :param input_paths: Image files, processed and reported in this order
+    :param output_dir: Directory for the output images
+    :param aggressiveness: How far above the base black a pixel may be to count as background,
+                           None to pick it per image from the brightness histogram
+    :param black_tol: Pixels with all channels <= this are removed as pure black
+    :param workers: I/O threads (default: CPU count)
+    :param prefetch: Images decoded ahead and encodes pending (default: workers)
+    :param output_format: One of OUTPUT_FORMATS
+    :param compress_level: zlib level of the PNG output, 0 (fast, large) - 9 (slow, small)
+    :param minimum_particle_size: Smaller particles are not counted (debris)
+    :param reports: Count the particles and write <name>_report.txt / _particles.csv / .json per image
+    :param remove_debris: Also make the fragments smaller than minimum_particle_size transparent
+    :return: Generator of (input path, stats dict or None, seconds or error message) in input order,
+             seconds from the start of the decode to the end of the encode. The stats hold 'output',
+             'aggressiveness', 'removed_pixels', 'total_pixels' and, with reports, the particle statistics.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}, expected one of {OUTPUT_FORMATS}")
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    prefetch = max(1, prefetch or workers)
+    save_options = {"compress_level": compress_level} if output_format == "png" else {}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sparse-drops-io") as pool:
+        queued = iter(input_paths)
+        decoding = deque()
+        encoding = deque()
+
+        def queue_decodes():
+            while len(decoding) < prefetch:
+                path = next(queued, None)
+                if path is None:
+                    return
+                decoding.append((path, time.perf_counter(), pool.submit(_decode, path)))
+
+        def finish_encode():
+            path, stats, start, future = encoding.popleft()
+            try:
+                future.result()
+            except Exception as e:
+                return path, None, str(e)
+            return path, stats, time.perf_counter() - start
+
+        queue_decodes()
+        while decoding:
+            path, start, future = decoding.popleft()
+            queue_decodes()
+            output_file = output_path_for(path, output_dir, output_format)
+            try:
+                img_array = future.result()
+                with instrumentation.stage("mask"):
+                    thresholds = auto_thresholds(img_array)
+                    used = thresholds["aggressiveness"] if aggressiveness is None else aggressiveness
+                    mask = background_mask(img_array, used, black_tol, thresholds)
+                stats, report_path, parameters = {}, None, None
+                if reports:
+                    with instrumentation.stage("particles"):
+                        stats = particle_statistics(~mask & (img_array[:, :, 3] > 0), minimum_particle_size)
+                    report_path = os.path.splitext(output_file)[0] + "_report.txt"
+                    parameters = {'aggressiveness': used, 'black_tolerance': black_tol,
+                                  'minimum_particle_size': minimum_particle_size, 'remove_debris': remove_debris}
+                if remove_debris:
+                    with instrumentation.stage("remove_debris"):
+                        mask |= debris_mask(img_array, mask, minimum_particle_size)
+                stats.update(output=output_file, aggressiveness=used, removed_pixels=int(mask.sum()),
+                             total_pixels=mask.size)
+            except Exception as e:
+                # Keep the results in input order: report the pending encodes first
+                while encoding:
+                    yield finish_encode()
+                yield path, None, str(e)
+                continue
+
+            encoding.append((path, stats, start, pool.submit(_encode, img_array, mask, output_file, save_options,
+                                                             report_path, stats, parameters, path)))
+            del img_array, mask
+            while len(encoding) > prefetch or (encoding and encoding[0][-1].done()):
+                yield finish_encode()
+
+        while encoding:
+            yield finish_encode()
+
+
+def write_summary(csv_path, results):
+    """
+    Write one row per image with the removed pixel percentage and the particle numbers.
+
+    :param csv_path: Output file
+    :param results: Tuples from stream_batch
+    """
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS)
+        for path, stats, seconds in results:
+            if stats is None:
+                continue
+            particles = [stats['particle_count'], f"{stats['coverage'] * 100:.3f}", f"{stats['d50']:.3f}"] \
+                if 'particle_count' in stats else ["", "", ""]
+            writer.writerow([path, stats['output'], stats['aggressiveness'], stats['removed_pixels'],
+                             stats['total_pixels'], f"{stats['removed_pixels'] / stats['total_pixels'] * 100:.3f}",
+                             *particles, f"{seconds:.3f}"])
+
+
+def aggressiveness_arg(value):
+    """argparse type: an integer, or 'auto' for None"""
+    return None if value == "auto" else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch background removal for scattered particles without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="Image directories, glob patterns or files")
+    parser.add_argument("-o", "--output-dir", default="output/freigestellt", help="Directory for the output images")
+    parser.add_argument("--aggressiveness", type=aggressiveness_arg, default=None,
+                        help="Aggressiveness (10 - 100), or 'auto' to choose it per image (default)")
+    parser.add_argument("--black-tolerance", type=int, default=10, help="Black tolerance (0 - 50)")
+    parser.add_argument("--min-particle-size", type=int, default=MINIMUM_PARTICLE_SIZE,
+                        help="Smaller particles are counted as debris, in pixels")
+    parser.add_argument("--no-report", action="store_true", help="Only remove the background, do not count particles")
+    parser.add_argument("--remove-debris", action="store_true",
+                        help="Also make the fragments smaller than --min-particle-size transparent")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="png", help="Output image format")
+    parser.add_argument("--compress-level", type=int, default=6, choices=range(10), metavar="0-9",
+                        help="PNG compression, lower is faster but gives larger files")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="I/O threads (default: CPU count)")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="Images decoded ahead of the mask computation (default: number of threads)")
+    args = parser.parse_args(argv)
+
+    input_paths = collect_inputs(args.inputs, IMAGE_EXTENSIONS)
+    if not input_paths:
+        parser.error("no images found")
+
+    start = time.perf_counter()
+    results = []
+    for done, result in enumerate(stream_batch(input_paths, args.output_dir, args.aggressiveness,
+                                               args.black_tolerance, args.workers, args.prefetch,
+                                               args.format, args.compress_level, args.min_particle_size,
+                                               not args.no_report, args.remove_debris), start=1):
+        path, stats, seconds = result
+        if stats is None:
+            print(f"[{done}/{len(input_paths)}] {path}: failed: {seconds}", file=sys.stderr)
+        else:
+            elapsed = time.perf_counter() - start
+            particles = f", {stats['particle_count']:,} particles" if 'particle_count' in stats else ""
+            print(f"[{done}/{len(input_paths)}] {path}: aggressiveness {stats['aggressiveness']}, removed "
+                  f"{stats['removed_pixels'] / stats['total_pixels']:.1%} of the pixels{particles} "
+                  f"({seconds:.1f}s, {done / elapsed:.2f} images/s)")
+        results.append(result)
+
+    elapsed = time.perf_counter() - start
+    write_summary(os.path.join(args.output_dir, "summary.csv"), results)
+    failed = sum(1 for _, stats, _ in results if stats is None)
+    print(f"Processed {len(results) - failed}/{len(results)} images in {elapsed:.1f}s "
+          f"({len(results) / elapsed:.2f} images/s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
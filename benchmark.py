@@ -0,0 +1,292 @@
+"""
+Speed and accuracy benchmark on synthetic samples.
+
+Generates metal-with-pores images with a known set of pores (and scattered
+particle images for sparse_drops), runs the tools on them and writes the
+timings per stage plus the accuracy against the ground truth to a JSON file.
+rembg is replaced by the exact foreground mask of the synthetic sample, so the
+benchmark runs offline and only measures our own code.
+
+Example:
+    python benchmark.py --sizes 1 4 16 --porosity 0.01 0.05 0.15 -o benchmark_results.json
+    python benchmark.py --sizes 1 4 16 -o new.json --compare benchmark_results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+import naive
+from removebg import cut_out
+from porosity_pipeline import PorosityPipeline
+from sparse_drops import remove_background_pixels
+
+BACKGROUND = (15, 15, 15)  # colour of the background and of the pores
+METAL = (175, 165, 150)  # mean colour of the metal
+NOISE = 20  # uniform noise amplitude on both
+PARAMETERS = {'black_tolerance': 0.6, 'minimum_cluster_size': 25, 'edge_width': 35, 'edge_samples': 120}
+
+
+def make_porous_sample(megapixels, porosity, seed=0, edge_width=PARAMETERS['edge_width']):
+    """
+    Synthetic metal cross-section: an ellipse of noisy metal on a dark background,
+    with round pores of background colour placed well inside the protected edge zone.
+
+    :param megapixels: Image size in millions of pixels (aspect ratio 4:3)
+    :param porosity: Target fraction of the object area covered by pores
+    :param seed: Random seed
+    :param edge_width: Pores are kept this far (plus their radius) away from the object edge
+    :return: Tuple of (RGB uint8 image, uint8 foreground mask with 255 = object, boolean pore mask)
+    """
+    rng = np.random.default_rng(seed)
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = int(height * 4 / 3)
+
+    # Object: ellipse filling most of the frame
+    yy, xx = np.ogrid[:height, :width]
+    ry, rx = height * 0.45, width * 0.45
+    inside = ((yy - height / 2) / ry) ** 2 + ((xx - width / 2) / rx) ** 2 <= 1
+    mask = np.where(inside, 255, 0).astype(np.uint8)
+
+    image = rng.integers(0, NOISE, (height, width, 3), dtype=np.uint8)
+    image += np.where(inside[:, :, None], np.array(METAL, np.uint8) - NOISE // 2, np.array(BACKGROUND, np.uint8))
+
+    # Pores: random discs until the target area is reached, centres far enough from the edge
+    pores = np.zeros((height, width), dtype=bool)
+    target = porosity * np.count_nonzero(inside)
+    covered = 0
+    margin = edge_width + 2
+    while covered < target:
+        radius = int(rng.integers(3, 16))
+        angle = rng.uniform(0, 2 * np.pi)
+        distance = np.sqrt(rng.uniform(0, 1))
+        cy = int(height / 2 + (ry - margin - radius) * distance * np.sin(angle))
+        cx = int(width / 2 + (rx - margin - radius) * distance * np.cos(angle))
+        y0, y1, x0, x1 = cy - radius, cy + radius + 1, cx - radius, cx + radius + 1
+        disc = (np.arange(-radius, radius + 1)[:, None] ** 2 + np.arange(-radius, radius + 1) ** 2) <= radius ** 2
+        covered += np.count_nonzero(disc & ~pores[y0:y1, x0:x1])
+        pores[y0:y1, x0:x1] |= disc
+
+    image[pores] = rng.integers(0, NOISE, (np.count_nonzero(pores), 3), dtype=np.uint8) + np.array(BACKGROUND,
+                                                                                                np.uint8)
+    return image, mask, pores
+
+
+def make_particle_sample(megapixels, coverage, seed=0):
+    """
+    Synthetic sparse_drops input: bright particles scattered on a dark background.
+
+    :param megapixels: Image size in millions of pixels (aspect ratio 4:3)
+    :param coverage: Fraction of the image covered by particles
+    :param seed: Random seed
+    :return: Tuple of (RGB uint8 image, boolean background mask)
+    """
+    rng = np.random.default_rng(seed)
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = int(height * 4 / 3)
+
+    # Particles: thresholded smoothed noise gives irregular blobs of the wanted coverage
+    field = ndimage.gaussian_filter(rng.random((height, width), dtype=np.float32), 6)
+    particles = field > np.quantile(field[::7, ::7], 1 - coverage)
+
+    image = rng.integers(0, NOISE, (height, width, 3), dtype=np.uint8)
+    image += np.where(particles[:, :, None], np.array(METAL, np.uint8) - NOISE // 2,
+                      np.array(BACKGROUND, np.uint8) - NOISE // 2)
+    return image, ~particles
+
+
+class MaskedPipeline(PorosityPipeline):
+    """PorosityPipeline with rembg replaced by a precomputed foreground mask."""
+
+    def __init__(self, input_path, mask):
+        super().__init__(input_path)
+        self.mask = mask
+
+    def background(self):
+        def compute():
+            raw, _ = self.load()
+            no_bg = cut_out(raw, self.mask)
+            return no_bg, naive.countvalidpixels(no_bg)
+        return self._stage("background", (), compute)
+
+
+class StageClock:
+    """Progress callback that records how long each reported stage took."""
+
+    def __init__(self):
+        self.stages = {}
+        self._current = None
+        self._start = None
+
+    def __call__(self, message):
+        self.stop()
+        self._current = message.rstrip('.')
+        self._start = time.perf_counter()
+
+    def stop(self):
+        if self._current is not None:
+            self.stages[self._current] = time.perf_counter() - self._start
+            self._current = None
+        return self.stages
+
+
+def pixel_accuracy(detected, truth):
+    """Precision and recall of a detected pixel mask against the ground truth."""
+    hits = np.count_nonzero(detected & truth)
+    found = np.count_nonzero(detected)
+    actual = np.count_nonzero(truth)
+    return {
+        'precision': hits / found if found else 1.0,
+        'recall': hits / actual if actual else 1.0,
+    }
+
+
+def bench_pipeline(megapixels, porosity, scratch, seed=0, pyramid=False):
+    image, mask, pores = make_porous_sample(megapixels, porosity, seed)
+    path = os.path.join(scratch, 'sample.bmp')
+    Image.fromarray(image).save(path)
+    del image
+
+    clock = StageClock()
+    start = time.perf_counter()
+    _, holes, stats = MaskedPipeline(path, mask).run(
+        PARAMETERS['black_tolerance'], PARAMETERS['minimum_cluster_size'], PARAMETERS['edge_width'],
+        PARAMETERS['edge_samples'], progress=clock, pyramid=pyramid)
+    total = time.perf_counter() - start
+
+    # Ground truth: pores as the analysis sees them, 4-connected and at least minimum_cluster_size big
+    labels, count = ndimage.label(pores)
+    truth_count = int(np.count_nonzero(np.bincount(labels.ravel())[1:] >= PARAMETERS['minimum_cluster_size']))
+    object_size = np.count_nonzero(mask)
+    accuracy = pixel_accuracy(holes.mask(), pores)
+    accuracy.update({
+        'pores_true': truth_count,
+        'pores_found': len(holes),
+        'density_true': 1 - np.count_nonzero(pores) / object_size,
+        'density_found': stats['density'],
+    })
+    return {'tool': 'porosity_pipeline' + ('_pyramid' if pyramid else ''), 'megapixels': megapixels,
+            'porosity': porosity,
+            'stages': clock.stop(), 'total': total, 'accuracy': accuracy}
+
+
+def bench_sweeper(megapixels, porosity, seed=0):
+    image, mask, _ = make_porous_sample(megapixels, porosity, seed)
+    rgba = cut_out(np.dstack([image, np.full(mask.shape, 255, np.uint8)]), mask)
+    pil_image = Image.fromarray(rgba, "RGBA")
+    black = naive.obtainblack(Image.fromarray(np.dstack([image, np.full(mask.shape, 255, np.uint8)]), "RGBA"))
+
+    start = time.perf_counter()
+    _, clusters = naive.sweeper(pil_image, black, 0.5, PARAMETERS['minimum_cluster_size'])
+    total = time.perf_counter() - start
+    return {'tool': 'naive.sweeper', 'megapixels': megapixels, 'porosity': porosity,
+            'stages': {'sweeper': total}, 'total': total, 'accuracy': {'clusters_found': len(clusters)}}
+
+
+def bench_sparse_drops(megapixels, coverage, scratch, seed=0):
+    image, background = make_particle_sample(megapixels, coverage, seed)
+    input_path = os.path.join(scratch, 'particles.bmp')
+    output_path = os.path.join(scratch, 'particles_out.png')
+    Image.fromarray(image).save(input_path)
+    del image
+
+    clock = StageClock()
+    start = time.perf_counter()
+    remove_background_pixels(input_path, output_path, aggressiveness=40, black_tol=10, progress=clock)
+    total = time.perf_counter() - start
+
+    removed = np.asarray(Image.open(output_path))[:, :, 3] == 0
+    return {'tool': 'sparse_drops', 'megapixels': megapixels, 'porosity': coverage,
+            'stages': clock.stop(), 'total': total, 'accuracy': pixel_accuracy(removed, background)}
+
+
+def run_benchmark(sizes, porosities, sweeper_max_mp=4, seed=0,
+                  tools=("pipeline", "pyramid", "sweeper", "sparse_drops")):
+    """
+    Run every tool on every size / porosity combination.
+
+    :return: Result dict as written to the JSON file
+    """
+    cases = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for megapixels in sizes:
+            for porosity in porosities:
+                runs = []
+                if "pipeline" in tools:
+                    runs.append(lambda: bench_pipeline(megapixels, porosity, scratch, seed))
+                if "pyramid" in tools:
+                    runs.append(lambda: bench_pipeline(megapixels, porosity, scratch, seed, pyramid=True))
+                if "sweeper" in tools and megapixels <= sweeper_max_mp:
+                    runs.append(lambda: bench_sweeper(megapixels, porosity, seed))
+                if "sparse_drops" in tools:
+                    runs.append(lambda: bench_sparse_drops(megapixels, porosity, scratch, seed))
+                for run in runs:
+                    case = run()
+                    print(f"{case['tool']:25} {megapixels:6.1f} MP  porosity {porosity:.2f}  "
+                          f"{case['total']:7.2f}s  {json.dumps(case['accuracy'], default=float)}")
+                    cases.append(case)
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'numpy': np.__version__, 'cpus': os.cpu_count()},
+        'parameters': PARAMETERS,
+        'cases': cases,
+    }
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    Print the speed of every case relative to a baseline result file.
+
+    :param threshold: Cases slower than baseline * threshold are marked
+    :return: Number of cases slower than the threshold
+    """
+    previous = {(c['tool'], c['megapixels'], c['porosity']): c for c in baseline['cases']}
+    slower = 0
+    for case in results['cases']:
+        old = previous.get((case['tool'], case['megapixels'], case['porosity']))
+        if old is None:
+            continue
+        ratio = case['total'] / old['total'] if old['total'] else float('inf')
+        mark = "  SLOWER" if ratio > threshold else ""
+        slower += bool(mark)
+        print(f"{case['tool']:25} {case['megapixels']:6.1f} MP  porosity {case['porosity']:.2f}  "
+              f"{old['total']:7.2f}s -> {case['total']:7.2f}s  ({ratio:.2f}x){mark}")
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the porosity tools on synthetic samples.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="Image sizes in megapixels")
+    parser.add_argument("--porosity", type=float, nargs="+", default=[0.01, 0.05, 0.15],
+                        help="Pore area fractions (particle coverage for sparse_drops)")
+    parser.add_argument("--tools", nargs="+", default=["pipeline", "pyramid", "sweeper", "sparse_drops"],
+                        choices=["pipeline", "pyramid", "sweeper", "sparse_drops"])
+    parser.add_argument("--sweeper-max-mp", type=float, default=4, help="Skip naive.sweeper above this size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="Result JSON file")
+    parser.add_argument("--compare", default=None, help="Earlier result JSON file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.sizes, args.porosity, args.sweeper_max_mp, args.seed, args.tools)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1, default=float)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(results, json.load(f)) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Reference black from the background band along the image border.
+
+The samples are the pixels of a grid that lie 10 to 20 pixels from the image
+border; edge_samples sets the grid density, and a large enough value takes
+every pixel of that band. Of those, the pixels that are visible in the
+original but were removed by rembg are true background and are reduced to one
+(R, G, B) colour with one of ESTIMATORS:
+
+    mean     per-channel average, rounded down (the original behaviour)
+    median   per-channel median, ignores a few bright specks or object pixels
+    trimmed  per-channel mean of the middle 80%
+    mode     per-channel histogram peak
+"""
+import numpy as np
+
+BORDER_WIDTH = 10  # samples start this many pixels from the image border and end at twice as many
+ESTIMATORS = ("mean", "median", "trimmed", "mode")
+TRIM_FRACTION = 0.1  # cut from each end for the trimmed mean
+
+
+def border_sample_points(height, width, edge_samples, border_width=BORDER_WIDTH):
+    """
+    Coordinates of the sample grid points that lie in the border band.
+
+    :param height: Image height
+    :param width: Image width
+    :param edge_samples: Number of grid points over the whole image, sets the grid spacing
+    :param border_width: Inner margin of the band, the band is border_width..2*border_width wide
+    :return: Tuple of (ys, xs) index arrays
+    """
+    spacing_x = max(1, width // int(edge_samples ** 0.5))
+    spacing_y = max(1, height // int(edge_samples ** 0.5))
+    ys = np.arange(border_width, height - border_width, spacing_y)
+    xs = np.arange(border_width, width - border_width, spacing_x)
+
+    # Rows close to the top or bottom border contribute every grid column,
+    # all other rows only the columns close to the left or right border
+    near_rows = (ys < border_width * 2) | (ys > height - border_width * 2)
+    near_cols = (xs < border_width * 2) | (xs > width - border_width * 2)
+    far_rows = ys[~near_rows]
+    side_cols = xs[near_cols]
+
+    sample_ys = np.concatenate([np.repeat(ys[near_rows], len(xs)), np.repeat(far_rows, len(side_cols))])
+    sample_xs = np.concatenate([np.tile(xs, int(near_rows.sum())), np.tile(side_cols, len(far_rows))])
+    return sample_ys, sample_xs
+
+
+def estimate_black(pixels, estimator="mean"):
+    """
+    Reduce background samples to one reference colour.
+
+    :param pixels: uint8 array of shape (n, 3), n > 0
+    :param estimator: One of ESTIMATORS
+    :return: (R, G, B) tuple of ints
+    """
+    if estimator == "mean":
+        value = pixels.sum(axis=0, dtype=np.int64) // len(pixels)
+    elif estimator == "median":
+        value = np.median(pixels, axis=0)
+    elif estimator == "trimmed":
+        cut = int(len(pixels) * TRIM_FRACTION)
+        ordered = np.sort(pixels, axis=0)
+        value = ordered[cut:len(pixels) - cut].mean(axis=0)
+    elif estimator == "mode":
+        value = [np.bincount(pixels[:, channel], minlength=256).argmax() for channel in range(3)]
+    else:
+        raise ValueError(f"Unknown estimator: {estimator}, expected one of {ESTIMATORS}")
+    return tuple(int(v) for v in np.rint(value))
+
+
+def corner_points(height, width):
+    """Coordinates (ys, xs) of the four pixels naive.obtainblack averages."""
+    return np.array([2, height - 1, height - 1, 0]), np.array([2, 0, width - 1, width - 1])
+
+
+def corner_black(corners):
+    """
+    Four-corner average of naive.obtainblack, for when no background sample was found.
+
+    :param corners: uint8 RGBA pixels at corner_points(), shape (4, 4)
+    :return: (R, G, B, A) tuple, like obtainblack on an RGBA image
+    """
+    return tuple(int(v) for v in corners.sum(axis=0, dtype=np.int64) // 4)
+
+
+def reference_black(raw, no_bg, edge_samples, estimator="mean"):
+    """
+    Reference black of an image from its border band.
+
+    :param raw: uint8 RGBA array of the original image
+    :param no_bg: uint8 RGBA array after background removal
+    :param edge_samples: Number of grid points over the whole image, sets the grid spacing
+    :param estimator: One of ESTIMATORS
+    :return: (R, G, B) tuple, or the four-corner average if no background sample was found
+    """
+    ys, xs = border_sample_points(raw.shape[0], raw.shape[1], edge_samples)
+    samples = raw[ys, xs]
+    # Visible in the original, removed by rembg: true background
+    background = (samples[:, 3] > 0) & (no_bg[ys, xs, 3] == 0)
+    if background.any():
+        return estimate_black(samples[background, :3], estimator)
+    return corner_black(raw[corner_points(raw.shape[0], raw.shape[1])])
@@ -0,0 +1,130 @@
+"""
+Automatic sparse_drops thresholds from colour histograms.
+
+One pass over the image in row chunks fills two small histograms: the 256 bin
+histogram of every RGB channel and the 766 bin histogram of the brightness
+R + G + B. Everything else is read off those histograms, so no full-size
+temporaries are needed:
+
+    otsu brightness   brightness that best separates background and particles
+    background        brightness histogram peak below the Otsu split
+    base black        per-channel histogram peak within the background share of
+                      the pixels, unlike a corner sample not thrown off by dirt in one spot
+    aggressiveness    how far the Otsu split lies above the base black, per channel
+    overlay threshold the 95th brightness percentile (exactly as np.percentile), but
+                      never at or below the Otsu split: with under 5% particles the
+                      percentile would otherwise mark background noise as overlay
+"""
+import numpy as np
+
+BRIGHTNESS_BINS = 3 * 255 + 1
+OVERLAY_PERCENTILE = 95
+CHUNK_PIXELS = 1 << 20  # pixels per row chunk, bounds the temporaries to a few MB
+
+
+def row_chunks(height, width, chunk_pixels=CHUNK_PIXELS):
+    """Row slices covering the image, each about chunk_pixels large."""
+    rows = max(1, chunk_pixels // max(width, 1))
+    for y in range(0, height, rows):
+        yield slice(y, min(y + rows, height))
+
+
+def brightness(rgb):
+    """R + G + B of a uint8 (..., 3+) array as uint16."""
+    total = rgb[..., 0].astype(np.uint16)
+    total += rgb[..., 1]
+    total += rgb[..., 2]
+    return total
+
+
+def image_histograms(img_array):
+    """
+    Channel and brightness histograms of an image.
+
+    :param img_array: uint8 array of shape (height, width, 3 or 4), alpha is ignored
+    :return: Tuple of (int64 array (3, 256) of channel counts, int64 array (766,) of brightness counts)
+    """
+    height, width = img_array.shape[:2]
+    channels = np.zeros((3, 256), dtype=np.int64)
+    bright = np.zeros(BRIGHTNESS_BINS, dtype=np.int64)
+    for rows in row_chunks(height, width):
+        chunk = img_array[rows]
+        for channel in range(3):
+            channels[channel] += np.bincount(chunk[..., channel].ravel(), minlength=256)
+        bright += np.bincount(brightness(chunk).ravel(), minlength=BRIGHTNESS_BINS)
+    return channels, bright
+
+
+def otsu_threshold(counts):
+    """
+    Otsu's threshold of a histogram: the bin that maximises the between-class variance.
+
+    :param counts: Histogram counts
+    :return: Bin index t, the lower class is bins 0..t. If the classes are separated by
+             empty bins, all splits in the gap are equally good and t is its middle.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    weight = np.cumsum(counts)
+    total = weight[-1]
+    if total == 0:
+        return 0
+    moment = np.cumsum(counts * np.arange(len(counts)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (moment[-1] * weight - moment * total) ** 2 / (weight * (total - weight))
+    # Splits with an empty class give 0/0
+    variance = np.nan_to_num(variance, nan=0.0, posinf=0.0)
+    best = np.flatnonzero(variance == variance.max())
+    return int(best[0] + best[-1]) // 2
+
+
+def histogram_quantile(counts, fraction):
+    """Smallest value with at least fraction of all counts at or below it."""
+    cumulative = np.cumsum(counts)
+    return int(np.searchsorted(cumulative, fraction * cumulative[-1], side='left'))
+
+
+def percentile_threshold(counts, q):
+    """
+    Smallest value v such that value >= v selects the same pixels as value >= np.percentile(values, q).
+
+    :param counts: Histogram of the integer values
+    :param q: Percentile, 0 - 100
+    :return: Integer threshold
+    """
+    cumulative = np.cumsum(counts)
+    position = q / 100 * (cumulative[-1] - 1)
+    lower_rank = int(np.floor(position))
+    lower = int(np.searchsorted(cumulative, lower_rank, side='right'))
+    upper = int(np.searchsorted(cumulative, min(lower_rank + 1, cumulative[-1] - 1), side='right'))
+    # np.percentile interpolates between the two neighbouring sorted values; no value lies
+    # strictly between them, so any fraction > 0 selects exactly the values >= upper
+    return upper if position > lower_rank and upper > lower else lower
+
+
+def auto_thresholds(img_array, channels=None, bright=None):
+    """
+    Background colour, automatic aggressiveness and overlay threshold of an image.
+
+    :param img_array: uint8 RGB(A) array
+    :param channels: Channel histograms if already computed (see image_histograms)
+    :param bright: Brightness histogram if already computed
+    :return: Dict with "base_black" (R, G, B), "background_brightness", "otsu_brightness",
+             "aggressiveness" and "overlay_brightness" (pixels with R + G + B >= this belong to the overlay box)
+    """
+    if channels is None or bright is None:
+        channels, bright = image_histograms(img_array)
+    otsu = otsu_threshold(bright)
+    # The background is darker than the particles in every channel, so the darkest
+    # background_share of each channel is background and its peak the base black
+    background_share = bright[:otsu + 1].sum() / max(bright.sum(), 1)
+    base_black = tuple(int(np.argmax(counts[:histogram_quantile(counts, background_share) + 1]))
+                       for counts in channels)
+    # A neutral pixel at the Otsu brightness has otsu / 3 in every channel
+    aggressiveness = max(0, int(round(otsu / 3 - sum(base_black) / 3)))
+    return {
+        "base_black": base_black,
+        "background_brightness": int(np.argmax(bright[:otsu + 1])),
+        "otsu_brightness": otsu,
+        "aggressiveness": aggressiveness,
+        "overlay_brightness": max(percentile_threshold(bright, OVERLAY_PERCENTILE), otsu + 1),
+    }
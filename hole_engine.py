@@ -0,0 +1,369 @@
+import numpy as np
+from scipy import ndimage
+
+PYRAMID_FACTOR = 4  # block size of the coarse level used by find_holes_pyramid
+# Above one candidate block group per this many pixels (dense porosity) labelling the whole
+# image at once is faster than handling the groups one by one
+PYRAMID_PIXELS_PER_GROUP = 8192
+
+
+def tolerance_bounds(black, tolerance):
+    """
+    Compute the per-channel colour window around the reference black.
+
+    :param black: Reference (R, G, B) colour
+    :param tolerance: Relative tolerance, e.g. 0.6 for +-60%
+    :return: Tuple of (minblack, maxblack) RGB tuples, clipped to 0..255
+    """
+    maxblack = tuple(int(min(x * (1 + tolerance), 255)) for x in black)
+    minblack = tuple(int(max(x * (1 - tolerance), 0)) for x in black)
+    return minblack, maxblack
+
+
+def edge_distance(object_mask):
+    """
+    Euclidean distance of every object pixel to the nearest background pixel.
+
+    Pixels outside the array count as background, so objects cut off by the
+    image border get a protected edge zone there as well.
+
+    :param object_mask: Boolean array, True on the object
+    :return: float32 array of the same shape, 0 on the background
+    """
+    padded = np.pad(object_mask, 1, constant_values=False)
+    return ndimage.distance_transform_edt(padded)[1:-1, 1:-1].astype(np.float32)
+
+
+def interior_from_distance(distance, edge_width):
+    """
+    Threshold an edge distance map into the interior mask for one edge width.
+
+    :param distance: Result of edge_distance()
+    :param edge_width: Width in pixels of the protected zone along the object edge
+    :return: Boolean array, True where holes may be detected
+    """
+    return distance > edge_width
+
+
+def tolerance_mask(rgb, minblack, maxblack):
+    """
+    Mark every pixel whose RGB value lies inside [minblack, maxblack] on all channels.
+
+    :param rgb: uint8 array of shape (height, width, 3) (extra channels are ignored)
+    :param minblack: Lower (R, G, B) bound, inclusive
+    :param maxblack: Upper (R, G, B) bound, inclusive
+    :return: Boolean array of shape (height, width)
+    """
+    mask = np.ones(rgb.shape[:2], dtype=bool)
+    for channel in range(3):
+        # Unsigned wrap-around turns lo <= v <= hi into a single comparison
+        # and avoids building (height, width, 3) temporaries
+        offset = rgb[..., channel] - np.uint8(minblack[channel])
+        mask &= offset <= np.uint8(maxblack[channel] - minblack[channel])
+    return mask
+
+
+def candidate_mask(rgba, interior_mask, black, tolerance):
+    """
+    Mark the hole candidates: non-transparent pixels inside the interior mask whose
+    colour lies within tolerance of the reference black.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param interior_mask: Boolean array, True where holes may be detected
+    :param black: Reference (R, G, B) colour
+    :param tolerance: Relative black tolerance
+    :return: Boolean array of shape (height, width)
+    """
+    minblack, maxblack = tolerance_bounds(black, tolerance)
+
+    # Candidate pixels: dark enough, visible and away from the object edge
+    candidates = tolerance_mask(rgba, minblack, maxblack)
+    candidates &= interior_mask
+    candidates &= rgba[:, :, 3] > 0
+    return candidates
+
+
+def label_mask(candidates):
+    """
+    Label the 4-connected components of a candidate mask.
+
+    Labels are numbered in raster order of their first pixel, which matches the
+    order the clusters were reported in.
+
+    :param candidates: Boolean array
+    :return: Tuple of (int32 label array, component sizes indexed by label)
+    """
+    labels, count = ndimage.label(candidates)
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    return labels, sizes
+
+
+def label_candidates(rgba, interior_mask, black, tolerance):
+    """
+    Label the hole candidates (see candidate_mask) as 4-connected components.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param interior_mask: Boolean array, True where holes may be detected
+    :param black: Reference (R, G, B) colour
+    :param tolerance: Relative black tolerance
+    :return: Tuple of (int32 label array, component sizes indexed by label)
+    """
+    return label_mask(candidate_mask(rgba, interior_mask, black, tolerance))
+
+
+def pack_mask(mask):
+    """Bit-pack a boolean mask, 1 bit per pixel."""
+    return np.packbits(mask.ravel())
+
+
+def unpack_mask(packed, shape):
+    """Boolean mask of the given shape from pack_mask's result."""
+    return np.unpackbits(packed, count=shape[0] * shape[1]).view(bool).reshape(shape)
+
+
+def block_pyramid(rgba, distance, factor=PYRAMID_FACTOR):
+    """
+    Coarse level of an image for find_holes_pyramid: per block of factor x factor pixels,
+    the range of every colour channel and the largest edge distance.
+
+    Computed once per image; it does not depend on the black tolerance or the edge width.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param distance: Result of edge_distance()
+    :param factor: Block size in pixels
+    :return: Dict with 'factor', 'low' and 'high' (uint8 arrays (blocks_y, blocks_x, 3) of the
+             per-channel minimum and maximum) and 'reach' (float32 array (blocks_y, blocks_x))
+    """
+    # All four channels keep the pixels contiguous, which is faster than slicing off alpha first
+    return {
+        'factor': factor,
+        'low': block_reduce(rgba, factor, np.minimum)[:, :, :3],
+        'high': block_reduce(rgba, factor, np.maximum)[:, :, :3],
+        'reach': block_reduce(distance, factor, np.maximum),
+    }
+
+
+def block_reduce(array, factor, reduce):
+    """
+    Reduce every block of factor x factor pixels to one value.
+
+    :param array: Array of shape (height, width, ...)
+    :param factor: Block size; blocks at the bottom and right edge may be smaller
+    :param reduce: Binary ufunc such as np.minimum or np.maximum
+    :return: Array of shape (ceil(height / factor), ceil(width / factor), ...)
+    """
+    for axis in (0, 1):
+        # Combine the factor interleaved slices along this axis instead of reshaping,
+        # which keeps the passes over memory sequential
+        array = np.moveaxis(array, axis, 0)
+        reduced = array[::factor].copy()
+        for offset in range(1, factor):
+            part = array[offset::factor]
+            reduce(reduced[:len(part)], part, out=reduced[:len(part)])
+        array = np.moveaxis(reduced, 0, axis)
+    return array
+
+
+def coarse_candidates(pyramid, minblack, maxblack, edge_width):
+    """
+    Blocks that may hold a hole candidate pixel.
+
+    Conservative: a block whose channel ranges all overlap the colour window and that
+    reaches past the protected edge zone may hold a candidate, every other block does not.
+
+    :return: Boolean array (blocks_y, blocks_x)
+    """
+    possible = pyramid['reach'] > edge_width
+    for channel in range(3):
+        possible &= pyramid['low'][..., channel] <= maxblack[channel]
+        possible &= pyramid['high'][..., channel] >= minblack[channel]
+    return possible
+
+
+def find_holes_pyramid(rgba, interior_mask, pyramid, black, tolerance, minimum_cluster_size, edge_width):
+    """
+    Find the holes from coarse to fine: the pixels are only classified and labelled inside
+    the groups of candidate blocks of the pyramid level.
+
+    Every candidate pixel lies in a candidate block, so each hole lies in one group
+    of 4-connected candidate blocks and is labelled there exactly as in the full image.
+    Groups with fewer pixels than minimum_cluster_size cannot hold a hole and are skipped.
+    The result is the same HoleSet as HoleSet.from_labels(*label_candidates(...)), which
+    is also what runs if there are too many groups for this to be faster.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param interior_mask: Boolean array, True where holes may be detected (edge distance > edge_width)
+    :param pyramid: Result of block_pyramid() for this image
+    :param black: Reference (R, G, B) colour
+    :param tolerance: Relative black tolerance
+    :param minimum_cluster_size: Minimum pixel count for a component to count as a hole
+    :param edge_width: Edge width the interior mask was made with
+    :return: HoleSet
+    """
+    factor = pyramid['factor']
+    height, width = interior_mask.shape
+    minblack, maxblack = tolerance_bounds(black, tolerance)
+
+    groups, count = ndimage.label(coarse_candidates(pyramid, minblack, maxblack, edge_width))
+    large = np.bincount(groups.ravel(), minlength=count + 1) * factor * factor >= minimum_cluster_size
+    large[0] = False
+    if np.count_nonzero(large) * PYRAMID_PIXELS_PER_GROUP > height * width:
+        labels, sizes = label_candidates(rgba, interior_mask, black, tolerance)
+        return HoleSet.from_labels(labels, sizes, minimum_cluster_size)
+
+    hole_mask = np.zeros((height, width), dtype=bool)
+    sizes, bboxes, firsts = [], [], []
+    for group, region in enumerate(ndimage.find_objects(groups), start=1):
+        if not large[group]:
+            continue
+        ys = slice(region[0].start * factor, min(region[0].stop * factor, height))
+        xs = slice(region[1].start * factor, min(region[1].stop * factor, width))
+
+        # Step 1: Pixels of this group's blocks, classified at full resolution
+        inside = np.repeat(np.repeat(groups[region] == group, factor, axis=0), factor, axis=1)
+        candidates = inside[:ys.stop - ys.start, :xs.stop - xs.start]
+        candidates &= tolerance_mask(rgba[ys, xs], minblack, maxblack)
+        candidates &= interior_mask[ys, xs]
+        candidates &= rgba[ys, xs, 3] > 0
+
+        # Step 2: Label them and keep the components big enough to be holes
+        labels, found = ndimage.label(candidates)
+        component_sizes = np.bincount(labels.ravel(), minlength=found + 1)
+        keep = component_sizes >= minimum_cluster_size
+        keep[0] = False
+        kept = int(np.count_nonzero(keep))
+        if not kept:
+            continue
+        renumber = np.zeros(found + 1, dtype=labels.dtype)
+        renumber[keep] = np.arange(1, kept + 1, dtype=labels.dtype)
+        hole_labels = renumber[labels]
+        hole_mask[ys, xs] |= hole_labels > 0
+
+        # Step 3: Records in image coordinates
+        sizes.append(component_sizes[keep])
+        bboxes.extend((s[0].start + ys.start, s[0].stop + ys.start, s[1].start + xs.start, s[1].stop + xs.start)
+                      for s in ndimage.find_objects(hole_labels, max_label=kept))
+        local_y, local_x = divmod(first_pixels(hole_labels, kept), xs.stop - xs.start)
+        firsts.append((local_y + ys.start) * width + local_x + xs.start)
+
+    if not sizes:
+        return HoleSet(np.packbits(hole_mask.ravel()), (height, width), np.zeros(0, np.int64),
+                       np.zeros((0, 4), np.int32), np.zeros(0, np.int64))
+    # Number the holes in raster order of their first pixel, like ndimage.label on the full image
+    firsts = np.concatenate(firsts).astype(np.int64)
+    order = np.argsort(firsts, kind='stable')
+    return HoleSet(np.packbits(hole_mask.ravel()), (height, width), np.concatenate(sizes).astype(np.int64)[order],
+                   np.array(bboxes, dtype=np.int32).reshape(-1, 4)[order], firsts[order])
+
+
+def first_pixels(labels, count):
+    """Flat index of the first pixel of each label 1..count (labels are numbered in raster order)."""
+    running_max = np.maximum.accumulate(labels.ravel())
+    return np.searchsorted(running_max, np.arange(1, count + 1))
+
+
+class HoleSet:
+    """
+    The holes of one analysed image in compact form.
+
+    Instead of one (y, x) tuple per hole pixel this keeps a bit-packed hole
+    mask (1 bit per image pixel) and one record per hole: size, bounding box
+    and first pixel. Holes are numbered 1..count in raster order of their
+    first pixel, the same order as the cluster sizes in the report, and every
+    per-hole lookup is a direct index into those records.
+    """
+
+    def __init__(self, packed, shape, sizes, bboxes, firsts):
+        """
+        :param packed: np.packbits of the flattened boolean hole mask
+        :param shape: (height, width) of the image
+        :param sizes: int64 pixel count per hole
+        :param bboxes: int32 array of shape (count, 4) with y0, y1, x0, x1 per hole (end exclusive)
+        :param firsts: int64 flat index of the first pixel of each hole
+        """
+        self.packed = packed
+        self.shape = tuple(shape)
+        self.sizes = sizes
+        self.bboxes = bboxes
+        self.firsts = firsts
+
+    @classmethod
+    def from_labels(cls, labels, sizes, minimum_cluster_size):
+        """
+        Keep the labelled components that are big enough to count as holes.
+
+        :param labels: Label array from label_candidates
+        :param sizes: Component sizes from label_candidates
+        :param minimum_cluster_size: Minimum pixel count for a component to count as a hole
+        :return: HoleSet
+        """
+        keep = sizes >= minimum_cluster_size
+        keep[0] = False
+        count = int(np.count_nonzero(keep))
+
+        # Renumber the kept components 1..count, everything else becomes 0
+        renumber = np.zeros(len(sizes), dtype=labels.dtype)
+        renumber[keep] = np.arange(1, count + 1, dtype=labels.dtype)
+        hole_labels = renumber[labels]
+
+        bboxes = np.array([(s[0].start, s[0].stop, s[1].start, s[1].stop)
+                           for s in ndimage.find_objects(hole_labels, max_label=count)],
+                          dtype=np.int32).reshape(-1, 4)
+        return cls(np.packbits(hole_labels.ravel() > 0), labels.shape, sizes[keep].astype(np.int64),
+                   bboxes, first_pixels(hole_labels, count).astype(np.int64))
+
+    def __len__(self):
+        return len(self.sizes)
+
+    @property
+    def clusters(self):
+        """Hole sizes as a list, in raster order."""
+        return self.sizes.tolist()
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes + self.sizes.nbytes + self.bboxes.nbytes + self.firsts.nbytes
+
+    def mask(self):
+        """Boolean hole mask of the whole image."""
+        return unpack_mask(self.packed, self.shape)
+
+    def scaled_mask(self, width, height, band_rows=1024):
+        """
+        Hole mask resized to width x height: a pixel of the result is marked if any
+        hole pixel falls on it (a block max-reduce when shrinking).
+
+        The packed mask is unpacked band_rows rows at a time, so no full-size array is built.
+
+        :return: Boolean array of shape (height, width)
+        """
+        image_height, image_width = self.shape
+        scaled = np.zeros((height, width), dtype=bool)
+        # Image column -> scaled column; the columns of one scaled pixel are consecutive
+        col_targets = np.arange(image_width) * width // image_width
+        col_starts = np.flatnonzero(np.diff(col_targets, prepend=-1))
+
+        for y0 in range(0, image_height, band_rows):
+            y1 = min(y0 + band_rows, image_height)
+            first_byte = y0 * image_width // 8
+            bits = np.unpackbits(self.packed[first_byte:-(-y1 * image_width // 8)])
+            start = y0 * image_width - first_byte * 8
+            band = bits[start:start + (y1 - y0) * image_width].reshape(y1 - y0, image_width).view(bool)
+
+            row_targets = np.arange(y0, y1) * height // image_height
+            row_starts = np.flatnonzero(np.diff(row_targets, prepend=-1))
+            reduced = np.logical_or.reduceat(np.logical_or.reduceat(band, col_starts, axis=1), row_starts, axis=0)
+            scaled[np.ix_(row_targets[row_starts], col_targets[col_starts])] |= reduced
+        return scaled
+
+    def labels(self):
+        """int32 label array with hole n labelled n and 0 elsewhere."""
+        labels, _ = ndimage.label(self.mask())
+        return labels
+
+    def size(self, label):
+        return int(self.sizes[label - 1])
+
+    def bbox(self, label):
+        """Bounding box (y0, y1, x0, x1) of a hole, end exclusive."""
+        return tuple(int(v) for v in self.bboxes[label - 1])
@@ -0,0 +1,247 @@
+"""
+Per-stage wall time, CPU time and memory of the analysis tools.
+
+Wrap a stage in `with stage("name"):`. While instrumentation is disabled (the
+default) that returns a shared no-op context manager, so the wrappers cost
+well under a microsecond. Once enabled, every stage records:
+
+    wall      elapsed seconds
+    cpu       CPU seconds of the whole process (includes worker threads of numpy/onnxruntime)
+    peak_mb   peak of Python + NumPy allocations during the stage (tracemalloc, only with memory=True)
+    rss_mb    peak resident set size of the process so far, read at the end of the stage
+
+Nested stages are recorded with a "parent/child" name. Enable from code with
+enable(), or from the environment before starting a tool:
+
+    POROSITY_PROFILE=1          record stage timings (added to the reports)
+    POROSITY_PROFILE_MEMORY=1   also trace allocations, slows NumPy-heavy stages down a little
+    POROSITY_TRACE=trace.json   write a Chrome/Perfetto trace (chrome://tracing) at exit,
+                                "{pid}" in the path is replaced by the process id (use it
+                                with batch_porosity.py, every worker writes its own file)
+"""
+import atexit
+import contextlib
+import json
+import multiprocessing.util
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_NULL = contextlib.nullcontext()
+_enabled = False
+_memory = False
+_trace_path = None
+_trace_pid = None
+_records = []
+_lock = threading.Lock()
+_local = threading.local()
+_origin = time.perf_counter()
+
+
+def enable(memory=False, trace_path=None):
+    """
+    Start recording stages.
+
+    :param memory: Also measure the peak allocation per stage with tracemalloc
+    :param trace_path: Write a Chrome trace of all recorded stages to this file at exit
+    """
+    global _enabled, _memory, _trace_path
+    _enabled = True
+    _memory = memory
+    _trace_path = trace_path
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+def stage(name):
+    """Context manager that records one stage, a no-op while disabled."""
+    if not _enabled:
+        return _NULL
+    return _Stage(name)
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class _Stage:
+    __slots__ = ("name", "start", "cpu", "peak")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            self.name = f"{stack[-1].name}/{self.name}"
+        self.peak = 0
+        if _memory:
+            # Hand the peak so far to the enclosing stages before measuring this one
+            peak = tracemalloc.get_traced_memory()[1]
+            for parent in stack:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        cpu = time.process_time() - self.cpu
+        stack = _local.stack
+        stack.pop()
+
+        record = {"stage": self.name, "wall": end - self.start, "cpu": cpu,
+                  "start": self.start - _origin, "thread": threading.get_ident()}
+        if _memory:
+            # Peaks of nested stages count towards their parents, the tracemalloc
+            # peak is reset so the parent's next part is measured on its own
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            for parent in stack:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+            record["peak_mb"] = peak / (1024 * 1024)
+        record["rss_mb"] = _max_rss_mb()
+
+        with _lock:
+            _records.append(record)
+        if _trace_path and _trace_pid != os.getpid():
+            _register_trace()
+        return False
+
+
+def _register_trace():
+    """Write the trace when this process exits, once per process (also in forked pool workers)."""
+    global _trace_pid
+    _trace_pid = pid = os.getpid()
+    path = _trace_path.replace("{pid}", str(pid))
+    written = []
+
+    def write_once():
+        if not written and os.getpid() == pid:
+            written.append(path)
+            write_trace(path)
+
+    atexit.register(write_once)
+    # Worker processes of a multiprocessing pool leave with os._exit and skip
+    # atexit, but they do run the multiprocessing finalizers
+    multiprocessing.util.Finalize(None, write_once, exitpriority=0)
+
+
+class ProgressStages:
+    """
+    Progress callback that also records every reported message as a stage.
+
+    For functions that already announce their stages through a progress callback:
+    each call closes the previous stage and opens the next one, leaving the
+    with block closes the last. All of them are nested in one stage called name.
+    """
+
+    def __init__(self, name, progress=None):
+        self.progress = progress
+        self._outer = stage(name)
+        self._current = None
+
+    def __enter__(self):
+        self._outer.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._close()
+        return self._outer.__exit__(*exc)
+
+    def __call__(self, message):
+        if self.progress:
+            self.progress(message)
+        self._close()
+        self._current = stage(message.rstrip('.').lower().replace(' ', '_'))
+        self._current.__enter__()
+
+    def _close(self):
+        if self._current is not None:
+            self._current.__exit__(None, None, None)
+            self._current = None
+
+
+def mark():
+    """Position in the record list, pass it to records() to get only the stages recorded after it."""
+    return len(_records)
+
+
+def records(since=0, this_thread=True):
+    """
+    Recorded stages in the order they finished.
+
+    :param since: Value of mark() to start from
+    :param this_thread: Only stages recorded by the calling thread
+    :return: List of record dicts
+    """
+    with _lock:
+        selected = _records[since:]
+    if this_thread:
+        ident = threading.get_ident()
+        selected = [r for r in selected if r["thread"] == ident]
+    return [dict(r) for r in selected]
+
+
+def reset():
+    with _lock:
+        _records.clear()
+
+
+def format_records(stage_records):
+    """Text table of stage records for the reports."""
+    lines = []
+    for r in sorted(stage_records, key=lambda r: r["start"]):
+        depth = r["stage"].count("/")
+        line = f"{'  ' * depth}{r['stage'].rsplit('/', 1)[-1]:<{40 - 2 * depth}} {r['wall']:8.3f}s wall {r['cpu']:8.3f}s cpu"
+        if "peak_mb" in r:
+            line += f" {r['peak_mb']:9.1f} MB peak"
+        if r.get("rss_mb") is not None:
+            line += f" {r['rss_mb']:9.1f} MB rss"
+        lines.append(line)
+    return lines
+
+
+def write_trace(path, stage_records=None):
+    """
+    Write stages in the Chrome trace event format (open in chrome://tracing or ui.perfetto.dev).
+
+    :param path: Output .json file
+    :param stage_records: Records to write, defaults to everything recorded in this process
+    """
+    if stage_records is None:
+        stage_records = records(this_thread=False)
+    events = [{"name": r["stage"], "ph": "X", "ts": r["start"] * 1e6, "dur": r["wall"] * 1e6,
+               "pid": os.getpid(), "tid": r["thread"],
+               "args": {k: r[k] for k in ("cpu", "peak_mb", "rss_mb") if k in r}}
+              for r in stage_records]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events}, f)
+
+
+if os.environ.get("POROSITY_PROFILE") or os.environ.get("POROSITY_PROFILE_MEMORY") or os.environ.get("POROSITY_TRACE"):
+    enable(memory=bool(os.environ.get("POROSITY_PROFILE_MEMORY")), trace_path=os.environ.get("POROSITY_TRACE"))
@@ -1,37 +1,50 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import PIL
-from naive import obtainblack, sweeper, clustereater, countvalidpixels, debrissweeper, complexblack, collect_border_pixels, find_border_clusters, new_sweeper, is_black
-from removebg import remove_background
+import numpy as np
+from naive import countvalidpixels, collect_border_positions, find_border_clusters, multi_sweeper
+from removebg import remove_background, warm_up
+from debris import eat_remnants
+from seed_segmentation import segment
+from structured_report import write_report, json_report_path
+import instrumentation
 from PIL import Image
 
-def process_image(inputpath, outputpath, black_tolerance, minimum_cluster_size, top, bottom, left, right):
-    rawimage = Image.open(inputpath)
-    rawimage = rawimage.convert("RGBA")
-    normalimagesize = countvalidpixels(rawimage)
+def process_image(inputpath, outputpath, black_tolerance, minimum_cluster_size, top, bottom, left, right,
+                  max_debris_size=0):
+    with instrumentation.stage("load"):
+        rawimage = Image.open(inputpath)
+        rawimage = rawimage.convert("RGBA")
+        normalimagesize = countvalidpixels(rawimage)
     
-    no_bg_image = remove_background(inputpath, False)
-    no_bg_image.save('outputrmbg/NO_BG_ONLY_output.png')
+    no_bg_image = remove_background(rawimage, False)
+    with instrumentation.stage("save_no_bg"):
+        no_bg_image.save('outputrmbg/NO_BG_ONLY_output.png')
     
-    borderpixels = collect_border_pixels(rawimage, top, bottom, left, right)
+    borderpixels = collect_border_positions(rawimage, top, bottom, left, right)
     
     # Find border clusters
-    forbidden_pixels = set(find_border_clusters(no_bg_image))
+    with instrumentation.stage("find_border_clusters"):
+        forbidden_pixels = find_border_clusters(no_bg_image)
     
-    cleaned_image = no_bg_image
-    clusters = []
+    with instrumentation.stage("sweep"):
+        cleaned_image, clusters = multi_sweeper(no_bg_image, borderpixels, black_tolerance, minimum_cluster_size, forbidden_pixels)
     
-    for pixel in borderpixels:
-        cleaned_image, tempclusters = new_sweeper(cleaned_image, pixel, black_tolerance, minimum_cluster_size, forbidden_pixels)
-        clusters.extend(tempclusters)
-    
-    density = countvalidpixels(cleaned_image) / countvalidpixels(no_bg_image)
+    with instrumentation.stage("count"):
+        density = countvalidpixels(cleaned_image) / countvalidpixels(no_bg_image)
     clusters = [int(x) for x in clusters]
     clustersum = sum(clusters)
     avg_cluster_size = sum(clusters) / len(clusters) if clusters else 0
     clusteramount = len(clusters)
     
-    cleaned_image.save(outputpath)
+    # Clear the specks around the object in the saved image only, 0 keeps them
+    if max_debris_size:
+        pixels = np.array(cleaned_image)
+        eat_remnants(pixels, max_debris_size)
+        cleaned_image = Image.fromarray(pixels, "RGBA")
+    
+    with instrumentation.stage("save_image"):
+        cleaned_image.save(outputpath)
     
     return normalimagesize, clusteramount, clusters, clustersum, avg_cluster_size, density
 
@@ -39,9 +52,12 @@ def naivemain(inputpath, outputpath,
               scriptpath, 
               blacktolerance=0.5, 
               minimumclustersize=30, 
-              maxdebrissize=50, top = False, bottom = False, left = False, right= False):
+              maxdebrissize=0, top = False, bottom = False, left = False, right= False):
 
-    normalimagesize, clusteramount, clusters, clustersum, avg_cluster_size, density = process_image(inputpath, outputpath, blacktolerance, minimumclustersize, top, bottom, left, right)
+    start = instrumentation.mark()
+    with instrumentation.stage("process_image"):
+        normalimagesize, clusteramount, clusters, clustersum, avg_cluster_size, density = process_image(inputpath, outputpath, blacktolerance, minimumclustersize, top, bottom, left, right, maxdebrissize)
+    timings = instrumentation.records(start)
     with open(scriptpath, "w") as f:
         f.write("Report: \n\n")
         f.write("All numbers here are expressed in terms of pixel count. If provided with an image scale and image size,\n one can easily convert these values to meaningful units. \n")
@@ -52,6 +68,17 @@ def naivemain(inputpath, outputpath,
         f.write(f"Cluster Sum: {clustersum}\n")
         f.write(f"Average Cluster Size: {avg_cluster_size}\n")
         f.write(f"Density: {density:.2%}\n")
+        if timings:
+            f.write("\nStage Timings:\n")
+            for line in instrumentation.format_records(timings):
+                f.write(line + "\n")
+
+    stats = {'normal_image_size': normalimagesize, 'cluster_amount': clusteramount, 'clusters': clusters,
+             'cluster_sum': clustersum, 'avg_cluster_size': avg_cluster_size, 'density': density,
+             'timings': timings}
+    parameters = {'black_tolerance': blacktolerance, 'minimum_cluster_size': minimumclustersize,
+                  'max_debris_size': maxdebrissize, 'top': top, 'bottom': bottom, 'left': left, 'right': right}
+    write_report(json_report_path(scriptpath), stats, parameters, tool="legacy_window.naivemain", source=inputpath)
 
 
 def compmain(inputpath='dataset/default.jpg', outputpath='outputrmbg/output.png', 
@@ -59,22 +86,15 @@ def compmain(inputpath='dataset/default.jpg', outputpath='outputrmbg/output.png'
               blacktolerance=0.5, 
               minimumclustersize=30, 
               maxdebrissize=50):
-    from naive import obtainblack, sweeper, clustereater, countvalidpixels, debrissweeper, complexblack
-    image = Image.open(inputpath)
-    image = image.convert("RGBA")
-    normalimagesize = countvalidpixels(image)
-    backgroundsize = 0
-    #removedpixels = 0
-    all_cluster_sizes = []
-    
-    while complexblack(image) != False:
-        black , pixel = complexblack(image)
-        image , local = clustereater(image, pixel[0], pixel[1], black, blacktolerance)
-        backgroundsize += local
-        image, clustersizes = sweeper(image, black, blacktolerance, minimumclustersize)
-        all_cluster_sizes.append(clustersizes)
-
-    objectsize = countvalidpixels(image)
+    with instrumentation.stage("load"):
+        pixels = np.array(Image.open(inputpath).convert("RGBA"))
+    normalimagesize = countvalidpixels(pixels)
+
+    # All border seeds at once instead of complexblack / clustereater / sweeper per background colour
+    with instrumentation.stage("segment"):
+        backgroundsize, clustersizes = segment(pixels, blacktolerance, minimumclustersize)
+
+    objectsize = countvalidpixels(pixels)
     clustersizes = [int(x) for x in clustersizes]
     average_cluster_size = sum(clustersizes) / len(clustersizes) if clustersizes else 0
     clustersum = sum(clustersizes)
@@ -82,7 +102,9 @@ def compmain(inputpath='dataset/default.jpg', outputpath='outputrmbg/output.png'
 
     density = objectsize/(objectsize + clustersum)
 
-    debrisimage = debrissweeper(image, maxdebrissize)
+    # Specks smaller than maxdebrissize around the object, painted like debrissweeper did
+    eat_remnants(pixels, maxdebrissize, erased=(255, 255, 255, 0))
+    debrisimage = Image.fromarray(pixels)
 
     clusteramount = len(clustersizes)
 
@@ -102,6 +124,14 @@ def compmain(inputpath='dataset/default.jpg', outputpath='outputrmbg/output.png'
         f.write(f"Object without Cluster: {objectwithoutcluster}\n")
         f.write(f"Density: {density:.2%}\n")
 
+    stats = {'normal_image_size': normalimagesize, 'background_size': backgroundsize, 'object_size': objectsize,
+             'cluster_amount': clusteramount, 'clusters': clustersizes, 'cluster_sum': clustersum,
+             'avg_cluster_size': average_cluster_size, 'object_without_cluster': objectwithoutcluster,
+             'density': density}
+    parameters = {'black_tolerance': blacktolerance, 'minimum_cluster_size': minimumclustersize,
+                  'max_debris_size': maxdebrissize}
+    write_report(json_report_path(scriptpath), stats, parameters, tool="legacy_window.compmain", source=inputpath)
+
 
 
 def browse_input():
@@ -122,7 +152,6 @@ def run_function():
         script_file = script_path.get()
         black_tol = float(black_tolerance.get())
         min_cluster = int(min_cluster_size.get())
-        max_debris = int(max_debris_size.get())
         top_val = top_var.get()
         bottom_val = bottom_var.get()
         left_val = left_var.get()
@@ -131,7 +160,8 @@ def run_function():
         if not input_file or not output_dir or not script_file:
             raise ValueError("Input, output, and script paths are required.")
         
-        naivemain(input_file, output_dir, script_file, black_tol, min_cluster, max_debris, top_val, bottom_val, left_val, right_val)
+        # Max Debris Size is for the complex function, the naive one keeps its output as before
+        naivemain(input_file, output_dir, script_file, black_tol, min_cluster, 0, top_val, bottom_val, left_val, right_val)
         messagebox.showinfo("Success", "Function executed successfully!")
    
 
@@ -218,7 +248,7 @@ static_text.insert(tk.END, """
 2. **Minimum Cluster Size** (default: 30):
    - A cluster of background pixel has to be this size to be removed - Higher : Keep more smaller clusters
 
-3. **Max Debris Size** (default: 50):
+3. **Max Debris Size** (default: 50, only used by "Run Complex Function"):
    - Leftover Clusters of frontground pixels have to be smaller than this to be removed - Higher : Keep fewer small clusters
 
 ## Process:
@@ -241,4 +271,6 @@ Click "Run Function" to process with current settings.
 static_text.config(state=tk.DISABLED)  # Make it read-
 
 if __name__ == "__main__":
+    # Load the rembg model while the window is open
+    warm_up()
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Content-addressed on-disk cache for rembg foreground masks.
+
+Masks are stored as 8-bit greyscale PNGs named after a hash of the decoded
+pixels and the model name, so re-analysing the same sample with other
+parameters skips inference, whether it is passed as a path or as an array.
+
+The directory is kept under a size cap by evicting the least recently used
+masks.
+"""
+import hashlib
+import os
+import tempfile
+
+from PIL import Image
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "POROSITY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "metal_porosity", "masks"))
+DEFAULT_MAX_MB = float(os.environ.get("POROSITY_CACHE_MAX_MB", 512))
+
+
+class MaskCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=int(DEFAULT_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(chunks, model_name):
+        """
+        Hash the input bytes together with the model name.
+
+        :param chunks: bytes, or an iterable of bytes chunks
+        :param model_name: rembg model name
+        :return: Hex digest used as the cache key
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(model_name.encode() + b"\0")
+        if isinstance(chunks, (bytes, bytearray, memoryview)):
+            chunks = [chunks]
+        for chunk in chunks:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    def get(self, key):
+        """
+        Load a cached mask and mark it as recently used.
+
+        :return: PIL Image in "L" mode, or None if the key is not cached
+        """
+        path = self.path(key)
+        try:
+            with Image.open(path) as cached:
+                mask = cached.convert("L")
+            os.utime(path)  # bump for LRU eviction
+        except (FileNotFoundError, OSError):
+            return None
+        return mask
+
+    def put(self, key, mask):
+        """Store a mask and evict old entries if the cache grew past its cap."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so parallel workers never read half a PNG
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                mask.convert("L").save(f, format="PNG")
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used masks until the cache fits into max_bytes."""
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.is_file() and entry.name.endswith(".png")]
+        except FileNotFoundError:
+            return
+
+        stats = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Delete every cached mask."""
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
@@ -4,14 +4,13 @@ from PIL import Image, ImageTk
 import numpy as np
 import os
 import io
-from scipy import ndimage
 
-# Import functions from naive.py
-from naive import (
-    obtainblack, sweeper, clustereater, countvalidpixels, 
-    collect_border_pixels, find_border_clusters, is_black
-)
-from removebg import remove_background
+from removebg import remove_background, warm_up
+from porosity_pipeline import PorosityPipeline, check_results, generate_report
+from pore_metrics import write_pore_table, pore_table_path
+from structured_report import write_report, json_report_path
+import instrumentation
+from background_job import BackgroundJob
 
 class PorosityAnalyzer:
     def __init__(self, root):
@@ -36,12 +35,20 @@ class PorosityAnalyzer:
         
         # Number of edge samples to use for black detection
         self.edge_samples = tk.IntVar(value=120)
+
+        # Clear the specks rembg leaves around the object (only the output image changes)
+        self.remove_debris = tk.BooleanVar(value=False)
+        # Search the holes coarse to fine (same results, faster on samples with few pores)
+        self.pyramid = tk.BooleanVar(value=False)
         
         # State variables
         self.current_image = None
         self.processed_image = None
         self.no_bg_image = None
-        self.current_holes = None
+        self.current_holes = None  # HoleSet of the processed image
+        self.preview_cache = {}  # rendered previews by (image, holes, size)
+        self.pipeline = None  # cached analysis stages of the current input image
+        self.job = None  # running background job, if any
         self.show_overlay = tk.BooleanVar(value=True)
         
         # Create UI
@@ -50,6 +57,9 @@ class PorosityAnalyzer:
         self.create_parameter_section()
         self.create_preview_section()
         
+        # Load the rembg model while the user picks an image
+        warm_up()
+        
     def create_frames(self):
         # Main container
         self.main_container = ttk.Frame(self.root, padding="10")
@@ -144,17 +154,35 @@ class PorosityAnalyzer:
                        variable=self.show_overlay,
                        command=self.toggle_overlay).grid(row=8, column=0, sticky="w", pady=5)
         
+        # Debris removal checkbox
+        ttk.Checkbutton(param_frame, text="Remove Debris Around the Object",
+                       variable=self.remove_debris).grid(row=9, column=0, sticky="w", pady=5)
+        
+        # Pyramid mode checkbox
+        ttk.Checkbutton(param_frame, text="Fast Hole Search (Few Pores)",
+                       variable=self.pyramid).grid(row=10, column=0, sticky="w", pady=5)
+        
         # Process buttons
         button_frame = ttk.Frame(param_frame)
-        button_frame.grid(row=9, column=0, sticky="ew", pady=10)
-        
-        ttk.Button(button_frame, text="Process Image", 
-                  command=self.process_image_ui).grid(row=0, column=0, padx=5, sticky="ew")
-        ttk.Button(button_frame, text="Save No-BG Only", 
-                  command=self.save_nobg_only).grid(row=0, column=1, padx=5, sticky="ew")
+        button_frame.grid(row=11, column=0, sticky="ew", pady=10)
+        
+        self.process_button = ttk.Button(button_frame, text="Process Image", 
+                  command=self.process_image_ui)
+        self.process_button.grid(row=0, column=0, padx=5, sticky="ew")
+        self.nobg_button = ttk.Button(button_frame, text="Save No-BG Only", 
+                  command=self.save_nobg_only)
+        self.nobg_button.grid(row=0, column=1, padx=5, sticky="ew")
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", 
+                  command=self.cancel_job, state="disabled")
+        self.cancel_button.grid(row=0, column=2, padx=5, sticky="ew")
                   
         button_frame.columnconfigure(0, weight=1)
         button_frame.columnconfigure(1, weight=1)
+        button_frame.columnconfigure(2, weight=1)
+        
+        # Progress of the running job
+        self.status_label = ttk.Label(param_frame, text="Ready")
+        self.status_label.grid(row=12, column=0, sticky="w")
         
     def create_preview_section(self):
         preview_frame = ttk.LabelFrame(self.preview_panel, text="Preview", padding="10")
@@ -209,6 +237,8 @@ Parameters:
         try:
             image = Image.open(image_path)
             self.current_image = image.convert("RGBA")
+            self.pipeline = None
+            self.preview_cache.clear()
             self.update_preview(self.current_image)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load image: {str(e)}")
@@ -226,26 +256,16 @@ Parameters:
                 new_height = max_size
                 new_width = int(max_size * aspect_ratio)
                 
-            display_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # If holes provided and overlay enabled, draw them
-            if holes and self.show_overlay.get():
-                display_array = np.array(display_image)
-                scale_factor = new_width / image.width
-                
-                # Draw semi-transparent green overlay
-                overlay = np.zeros_like(display_array)
-                for y, x in holes:
-                    new_y = int(y * scale_factor)
-                    new_x = int(x * scale_factor)
-                    if 0 <= new_y < new_height and 0 <= new_x < new_width:
-                        if display_array[new_y, new_x, 3] > 0:  # Only overlay non-transparent pixels
-                            overlay[new_y, new_x] = [0, 255, 0, 128]
-                
-                # Blend overlay with display image
-                mask = overlay[:, :, 3:4] / 255.0
-                display_array = display_array * (1 - mask) + overlay * mask
-                display_image = Image.fromarray(display_array.astype(np.uint8))
+            # Toggling the overlay or re-showing an image reuses the rendered preview
+            if holes is None or not self.show_overlay.get():
+                holes = None
+            key = (id(image), id(holes), new_width, new_height)
+            cached = self.preview_cache.get(key)
+            if cached is None:
+                display_image = self.render_preview(image, holes, new_width, new_height)
+                # Keep image and holes referenced so their ids stay unique
+                cached = self.preview_cache[key] = (image, holes, display_image)
+            display_image = cached[2]
             
             photo = ImageTk.PhotoImage(display_image)
             
@@ -255,257 +275,176 @@ Parameters:
             self.preview_canvas.create_image(new_width/2, new_height/2, image=photo, anchor="center")
             self.preview_canvas.image = photo  # Keep a reference to prevent garbage collection
     
+    def render_preview(self, image, holes, new_width, new_height):
+        display_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        if holes is None:
+            return display_image
+        
+        # Scale the hole mask to the preview: a preview pixel is marked if any hole pixel falls on it
+        display_array = np.array(display_image)
+        marked = holes.scaled_mask(new_width, new_height)
+        marked &= display_array[:, :, 3] > 0  # Only overlay non-transparent pixels
+        
+        # Blend a semi-transparent green over the marked pixels in one step
+        green = np.array([0, 255, 0, 128])
+        alpha = green[3] / 255.0
+        display_array[marked] = (display_array[marked] * (1 - alpha) + green * alpha).astype(np.uint8)
+        return Image.fromarray(display_array)
+    
     def toggle_overlay(self):
-        if self.processed_image and self.current_holes:
+        if self.processed_image and self.current_holes is not None:
             self.update_preview(self.processed_image, self.current_holes)
     
+    def start_job(self, target, on_done):
+        """Run target(job) on a worker thread while the window stays responsive."""
+        if self.job and self.job.running():
+            messagebox.showinfo("Busy", "Another image is still being processed.")
+            return
+        
+        def finished():
+            self.job = None
+            self.process_button.config(state="normal")
+            self.nobg_button.config(state="normal")
+            self.cancel_button.config(state="disabled")
+        
+        def done(result):
+            finished()
+            self.status_label.config(text="Done")
+            on_done(result)
+        
+        def error(e):
+            finished()
+            self.status_label.config(text="Failed")
+            messagebox.showerror("Error", f"Processing failed: {str(e)}")
+        
+        def cancelled():
+            finished()
+            self.status_label.config(text="Cancelled")
+        
+        self.process_button.config(state="disabled")
+        self.nobg_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.status_label.config(text="Starting...")
+        self.job = BackgroundJob(self.root, target,
+                                 on_progress=lambda message: self.status_label.config(text=message),
+                                 on_done=done, on_error=error, on_cancelled=cancelled).start()
+    
+    def cancel_job(self):
+        if self.job:
+            self.status_label.config(text="Cancelling after the current stage...")
+            self.job.cancel()
+    
     def save_nobg_only(self):
         if not self.input_path.get():
             messagebox.showerror("Error", "Please select an input image.")
             return
             
+        # Create output directory
         try:
-            # Create output directory
             os.makedirs(self.output_dir.get(), exist_ok=True)
-            
-            # Get paths
-            input_path = self.input_path.get()
-            output_path = os.path.join(self.output_dir.get(), "nobg_" + self.output_file.get())
-            
+        except OSError as e:
+            messagebox.showerror("Error", f"Processing failed: {str(e)}")
+            return
+        
+        # Get paths (Tk variables are only read on the main thread)
+        input_path = self.input_path.get()
+        output_path = os.path.join(self.output_dir.get(), "nobg_" + self.output_file.get())
+        
+        def work(job):
             # Remove background only
+            job.progress("Removing background")
             no_bg_image = remove_background(input_path, False)
-            no_bg_image.save(output_path)
-            
+            job.progress("Saving image")
+            with instrumentation.stage("save_image"):
+                no_bg_image.save(output_path)
+            return no_bg_image
+        
+        def done(no_bg_image):
             # Update preview
             self.no_bg_image = no_bg_image
             self.update_preview(no_bg_image)
-            
             messagebox.showinfo("Success", "Background removed successfully!")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Processing failed: {str(e)}")
+        
+        self.start_job(work, done)
     
     def process_image_ui(self):
         if not self.input_path.get():
             messagebox.showerror("Error", "Please select an input image.")
             return
             
+        # Create output directory
         try:
-            # Create output directory
             os.makedirs(self.output_dir.get(), exist_ok=True)
-            
-            # Get paths
-            input_path = self.input_path.get()
-            output_path = os.path.join(self.output_dir.get(), self.output_file.get())
-            report_path = os.path.join(self.output_dir.get(), self.report_file.get())
-            
-            # Process image
-            processed_image, hole_pixels, stats = self.process_image(
-                input_path, 
-                self.black_tolerance.get(),
-                self.min_cluster_size.get(),
-                self.edge_samples.get()
-            )
+        except OSError as e:
+            messagebox.showerror("Error", f"Processing failed: {str(e)}")
+            return
+        
+        # Get paths and parameters (Tk variables are only read on the main thread)
+        input_path = self.input_path.get()
+        output_path = os.path.join(self.output_dir.get(), self.output_file.get())
+        report_path = os.path.join(self.output_dir.get(), self.report_file.get())
+        debug_path = os.path.join(self.output_dir.get(), "debug_mask.png")
+        black_tolerance = self.black_tolerance.get()
+        min_cluster_size = self.min_cluster_size.get()
+        edge_width = self.edge_width.get()
+        edge_samples = self.edge_samples.get()
+        remove_debris = self.remove_debris.get()
+        pyramid = self.pyramid.get()
+        pipeline = self.get_pipeline(input_path)
+        
+        def work(job):
+            # Process image; stages finished before a cancel stay cached in the pipeline
+            processed_image, holes, stats = pipeline.run(
+                black_tolerance, min_cluster_size, edge_width, edge_samples, debug_path,
+                progress=job.progress, remove_debris=remove_debris, pyramid=pyramid)
             
             # Save results
-            processed_image.save(output_path)
+            job.progress("Saving results")
+            save_start = instrumentation.mark()
+            with instrumentation.stage("save_image"):
+                processed_image.save(output_path)
+            if 'timings' in stats:
+                stats = dict(stats, timings=stats['timings'] + instrumentation.records(save_start))
             self.generate_report(report_path, stats)
-            
+            write_pore_table(pore_table_path(report_path), stats['pores'])
+            parameters = {'black_tolerance': black_tolerance, 'minimum_cluster_size': min_cluster_size,
+                          'edge_width': edge_width, 'edge_samples': edge_samples, 'remove_debris': remove_debris,
+                          'pyramid': pyramid}
+            write_report(json_report_path(report_path), stats, parameters,
+                         tool="metal_porosity_analyzer", source=input_path)
+            return processed_image, holes
+        
+        def done(result):
             # Update preview with processed image
+            processed_image, holes = result
             self.processed_image = processed_image
-            self.current_holes = hole_pixels
-            self.update_preview(processed_image, hole_pixels if self.show_overlay.get() else None)
-            
+            self.current_holes = holes
+            self.preview_cache.clear()
+            self.update_preview(processed_image, holes if self.show_overlay.get() else None)
             messagebox.showinfo("Success", "Image processed successfully!")
-            
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            messagebox.showerror("Error", f"Processing failed: {str(e)}")
+        
+        self.start_job(work, done)
+    
+    def get_pipeline(self, input_path):
+        # Keep the pipeline state between runs on the same image so that only
+        # the stages affected by changed sliders are recomputed
+        if self.pipeline is None or self.pipeline.input_path != input_path:
+            self.pipeline = PorosityPipeline(input_path)
+        return self.pipeline
     
     def process_image(self, input_path, black_tolerance, minimum_cluster_size, edge_samples):
         """Process the image using a scientific approach to detect black pixels and ignore edge regions"""
-        # Step 1: Load the image
-        raw_image = Image.open(input_path)
-        raw_image = raw_image.convert("RGBA")
-        normal_image_size = countvalidpixels(raw_image)
-        
-        # Step 2: Remove background using rembg
-        no_bg_image = remove_background(input_path, False)
-        no_bg_size = countvalidpixels(no_bg_image)
-        
-        # Step 3: Create a mask of the non-transparent pixels
-        width, height = no_bg_image.size
-        object_mask = np.zeros((height, width), dtype=bool)
-        for y in range(height):
-            for x in range(width):
-                object_mask[y, x] = no_bg_image.getpixel((x, y))[3] > 0
-        
-        # Step 4: Create an interior mask by eroding the object mask
-        # This gives us a "safe zone" that's definitely not edge pixels
-        # Use the edge width from the slider
-        edge_width = self.edge_width.get()
-        interior_mask = ndimage.binary_erosion(object_mask, iterations=edge_width)
-        
-        # Step 5: Scientifically determine the "black" reference value
-        # Sample pixels around the edge of the original image
-        edge_pixels = []
-        # Calculate sample spacing
-        spacing_x = max(1, width // int(edge_samples ** 0.5))
-        spacing_y = max(1, height // int(edge_samples ** 0.5))
-        
-        # Sample a grid of pixels near the edge
-        border_width = 10  # Sample within 10 pixels of the edge
-        for y in range(border_width, height - border_width, spacing_y):
-            for x in range(border_width, width - border_width, spacing_x):
-                # Only sample if the pixel is near the edge
-                if (x < border_width * 2 or x > width - border_width * 2 or
-                    y < border_width * 2 or y > height - border_width * 2):
-                    edge_pixels.append((x, y))
-        
-        # Now check which of these edge pixels were removed by rembg
-        black_candidates = []
-        for x, y in edge_pixels:
-            raw_pixel = raw_image.getpixel((x, y))
-            if raw_pixel[3] > 0:  # Not transparent in original
-                if no_bg_image.getpixel((x, y))[3] == 0:  # Transparent in rembg output
-                    # This was a background pixel - add it as a black candidate
-                    black_candidates.append(raw_pixel[:3])  # Just use RGB values
-        
-        # Calculate the average of the black candidates
-        if black_candidates:
-            avg_r = sum(p[0] for p in black_candidates) // len(black_candidates)
-            avg_g = sum(p[1] for p in black_candidates) // len(black_candidates)
-            avg_b = sum(p[2] for p in black_candidates) // len(black_candidates)
-            black = (avg_r, avg_g, avg_b)
-        else:
-            # Fallback to original method if no candidates found
-            black = obtainblack(raw_image)
-            
-        # Create debug image showing the interior mask (keep this one)
-        debug_image = no_bg_image.copy()
-        for y in range(height):
-            for x in range(width):
-                if object_mask[y, x] and not interior_mask[y, x]:
-                    # This is an edge pixel (in the border zone) - color it red
-                    debug_image.putpixel((x, y), (255, 0, 0, 255))
-        
         debug_path = os.path.join(self.output_dir.get(), "debug_mask.png")
-        debug_image.save(debug_path)
-        
-        # Step 6: Calculate black tolerance bounds
-        maxblack = tuple(int(min(x * (1 + black_tolerance), 255)) for x in black)
-        minblack = tuple(int(max(x * (1 - black_tolerance), 0)) for x in black)
-        
-        # Step 7: Detect and remove holes in the interior region only
-        cleaned_image = no_bg_image.copy()
-        clusters = []
-        
-        # Find hole candidates inside the interior mask
-        potential_holes = []
-        for y in range(height):
-            for x in range(width):
-                if interior_mask[y, x]:  # Only look in the interior region
-                    pixel = no_bg_image.getpixel((x, y))
-                    r, g, b, a = pixel
-                    # Check if it's a potential hole based on color
-                    if all(minblack[i] <= [r, g, b][i] <= maxblack[i] for i in range(3)):
-                        potential_holes.append((x, y))
-        
-        # Process each potential hole using connected components
-        visited = set()
-        for start_x, start_y in potential_holes:
-            if (start_x, start_y) in visited or cleaned_image.getpixel((start_x, start_y))[3] == 0:
-                continue
-                
-            # Start a new cluster
-            cluster = []
-            queue = [(start_x, start_y)]
-            local_visited = set([(start_x, start_y)])
-            
-            # Flood fill to find the entire connected component
-            while queue:
-                x, y = queue.pop(0)
-                visited.add((x, y))
-                pixel = cleaned_image.getpixel((x, y))
-                r, g, b, a = pixel
-                
-                # If this is a hole pixel (dark enough)
-                if a > 0 and all(minblack[i] <= [r, g, b][i] <= maxblack[i] for i in range(3)):
-                    cluster.append((x, y))
-                    
-                    # Check neighbors (4-connected)
-                    for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                        nx, ny = x + dx, y + dy
-                        if (0 <= nx < width and 0 <= ny < height and 
-                            (nx, ny) not in local_visited and 
-                            interior_mask[ny, nx]):  # Only check interior pixels
-                            queue.append((nx, ny))
-                            local_visited.add((nx, ny))
-            
-            # Remove the cluster if it's large enough
-            if len(cluster) >= minimum_cluster_size:
-                for x, y in cluster:
-                    cleaned_image.putpixel((x, y), (0, 0, 0, 0))  # Make transparent
-                clusters.append(len(cluster))
-        
-        # Collect all hole pixels for visualization
-        all_hole_pixels = []
-        for y in range(height):
-            for x in range(width):
-                if (no_bg_image.getpixel((x, y))[3] != 0 and 
-                    cleaned_image.getpixel((x, y))[3] == 0):
-                    all_hole_pixels.append((y, x))  # Note: y,x order for visualization
-        
-        # Calculate statistics
-        stats = self.check_results(cleaned_image, clusters, normal_image_size, no_bg_size)
-        
-        return cleaned_image, all_hole_pixels, stats
-
+        return self.get_pipeline(input_path).run(black_tolerance, minimum_cluster_size,
+                                 self.edge_width.get(), edge_samples, debug_path)
 
     def check_results(self, cleaned_image, clusters, normal_image_size, no_bg_size):
         """Calculate statistics from processed image"""
-        # Convert cluster sizes to integers
-        clusters = [int(x) for x in clusters]
-        
-        # Calculate statistics
-        final_image_size = countvalidpixels(cleaned_image)
-        density = final_image_size / no_bg_size if no_bg_size > 0 else 1
-        cluster_sum = sum(clusters)
-        avg_cluster_size = sum(clusters) / len(clusters) if clusters else 0
-        cluster_amount = len(clusters)
-        
-        stats = {
-            'normal_image_size': normal_image_size,
-            'no_bg_size': no_bg_size,
-            'final_image_size': final_image_size,
-            'cluster_amount': cluster_amount,
-            'clusters': clusters,
-            'cluster_sum': cluster_sum,
-            'avg_cluster_size': avg_cluster_size,
-            'density': density
-        }
-        
-        return stats
+        return check_results(cleaned_image, clusters, normal_image_size, no_bg_size)
     
     def generate_report(self, report_path, stats):
         """Generate analysis report with statistics."""
-        with open(report_path, 'w') as f:
-            f.write("Metal Porosity Analysis Report\n")
-            f.write("=======================\n\n")
-            
-            f.write("All numbers here are expressed in terms of pixel count. If provided with an image scale and image size,\n")
-            f.write("one can easily convert these values to meaningful units.\n")
-            f.write("Clusters are the holes within the object itself.\n\n")
-            
-            f.write(f"Normal Image Size: {stats['normal_image_size']}\n")
-            f.write(f"Object Size (after bg removal): {stats['no_bg_size']}\n")
-            f.write(f"Final Object Size (after hole removal): {stats['final_image_size']}\n")
-            f.write(f"Cluster Amount: {stats['cluster_amount']}\n")
-            f.write(f"Cluster Sizes: {stats['clusters']}\n")
-            f.write(f"Cluster Sum: {stats['cluster_sum']}\n")
-            f.write(f"Average Cluster Size: {stats['avg_cluster_size']:.2f}\n")
-            f.write(f"Density: {stats['density']:.2%}\n")
+        generate_report(report_path, stats)
 
 def main():
     root = tk.Tk()
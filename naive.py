@@ -1,5 +1,27 @@
 from PIL import Image
 import numpy as np
+from scipy import ndimage
+
+# Pixel engine behind sweeper / miniclusterchecker / clustereater / countvalidpixels / debrissweeper:
+# "numpy" uses the array-backed versions in naive_numpy.py, "pil" the per-pixel code below.
+# Both give the same cluster sizes and output image.
+BACKEND = "numpy"
+
+
+def set_backend(name):
+    """
+    Select the engine used by sweeper, miniclusterchecker, clustereater, countvalidpixels and debrissweeper.
+
+    :param name: "numpy" or "pil"
+    """
+    global BACKEND
+    if name not in ("numpy", "pil"):
+        raise ValueError(f"Unknown backend: {name}")
+    BACKEND = name
+
+
+def _numpy_backend(backend):
+    return (backend or BACKEND) == "numpy"
 
 
 def is_black(pixel, tolerance):
@@ -17,45 +39,22 @@ def is_black(pixel, tolerance):
 def find_border_clusters(image):
     """
     Find clusters that border pixels with alpha=0 and return all pixels of these clusters.
-    
-    :param image: PIL Image in RGBA mode
-    :return: List of pixel coordinates (x, y) that belong to border clusters
-    """
-    width, height = image.size
-    pixels = np.array(image)
-    alpha_mask = pixels[:,:,3] == 0
-    border_pixels = set()
 
-    for y in range(height):
-        for x in range(width):
-            if pixels[y, x, 3] != 0:  # If pixel is not transparent
-                # Check neighboring pixels
-                for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
-                    nx, ny = x + dx, y + dy
-                    if 0 <= nx < width and 0 <= ny < height and alpha_mask[ny, nx]:
-                        border_pixels.add((x, y))
-                        break
+    The opaque pixels are labelled once (4-connected); every label with a pixel
+    next to a transparent one is a border cluster.
+
+    :param image: PIL Image in RGBA mode, or a uint8 array of shape (height, width, 4)
+    :return: Boolean array of shape (height, width), True on the pixels of border clusters
+    """
+    transparent = np.asarray(image)[:, :, 3] == 0
+    labels, count = ndimage.label(~transparent)
+    # Opaque pixels with a transparent 4-neighbour; the image edge does not count as transparent
+    touching = ndimage.binary_dilation(transparent) & ~transparent
+    is_border = np.zeros(count + 1, dtype=bool)
+    is_border[labels[touching]] = True
+    is_border[0] = False
+    return is_border[labels]
 
-    # Perform flood fill from each border pixel to find the clusters
-    visited = set()
-    clusters = []
-
-    for start_pixel in border_pixels:
-        if start_pixel not in visited:
-            cluster = set()
-            stack = [start_pixel]
-            while stack:
-                x, y = stack.pop()
-                if (x, y) not in visited:
-                    visited.add((x, y))
-                    cluster.add((x, y))
-                    for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
-                        nx, ny = x + dx, y + dy
-                        if 0 <= nx < width and 0 <= ny < height and pixels[ny, nx, 3] != 0:
-                            stack.append((nx, ny))
-            clusters.append(list(cluster))
-
-    return [pixel for cluster in clusters for pixel in cluster]
 
 def new_sweeper(image, start_pixel, black_tolerance, minimum_cluster_size, forbidden_pixels):
     """
@@ -65,7 +64,8 @@ def new_sweeper(image, start_pixel, black_tolerance, minimum_cluster_size, forbi
     :param start_pixel: Starting pixel for flood fill
     :param black_tolerance: Tolerance for considering a pixel as "black"
     :param minimum_cluster_size: Minimum size for a valid cluster
-    :param forbidden_pixels: Set of pixel coordinates that should not be removed
+    :param forbidden_pixels: Boolean array (height, width) of pixels that should not be removed,
+                             see find_border_clusters
     :return: Tuple of (cleaned image, list of cluster sizes)
     """
     width, height = image.size
@@ -85,12 +85,52 @@ def new_sweeper(image, start_pixel, black_tolerance, minimum_cluster_size, forbi
                     if 0 <= nx < width and 0 <= ny < height:
                         stack.append((nx, ny))
 
-    if len(cluster) >= minimum_cluster_size and not cluster.intersection(forbidden_pixels):
+    if len(cluster) >= minimum_cluster_size and not any(forbidden_pixels[y, x] for x, y in cluster):
         for x, y in cluster:
             pixels[x, y] = (0, 0, 0, 0)  # Make pixel transparent
         return image, [len(cluster)]
     else:
         return image, []
+
+
+def multi_sweeper(image, start_pixels, black_tolerance, minimum_cluster_size, forbidden_pixels):
+    """
+    new_sweeper for many start pixels at once.
+
+    The black pixels are labelled once (4-connected, as in new_sweeper). Each
+    cluster is handled at its first start pixel; later start pixels in the same
+    cluster find it already removed or rejected, just like repeated new_sweeper
+    calls, so the image and the cluster sizes are identical.
+
+    :param image: PIL Image in RGBA mode, changed in place
+    :param start_pixels: Sequence of (x, y) start pixels, handled in this order
+    :param black_tolerance: Tolerance for considering a pixel as "black"
+    :param minimum_cluster_size: Minimum size for a valid cluster
+    :param forbidden_pixels: Boolean array (height, width) of pixels that should not be removed,
+                             see find_border_clusters
+    :return: Tuple of (cleaned image, list of cluster sizes)
+    """
+    pixels = np.array(image)
+    black = (pixels[:, :, :3] <= black_tolerance).all(axis=2) & (pixels[:, :, 3] > 0)
+    labels, count = ndimage.label(black)
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    touches_forbidden = np.zeros(count + 1, dtype=bool)
+    touches_forbidden[labels[forbidden_pixels]] = True
+
+    start_pixels = np.asarray(start_pixels, dtype=np.intp).reshape(-1, 2)
+    start_labels = labels[start_pixels[:, 1], start_pixels[:, 0]]
+    # First start pixel of every cluster, in start pixel order
+    seen, first = np.unique(start_labels, return_index=True)
+    order = seen[np.argsort(first)]
+    order = order[order > 0]
+    removed = order[(sizes[order] >= minimum_cluster_size) & ~touches_forbidden[order]]
+
+    if len(removed):
+        is_removed = np.zeros(count + 1, dtype=bool)
+        is_removed[removed] = True
+        pixels[is_removed[labels]] = (0, 0, 0, 0)  # Make pixels transparent
+        image.paste(Image.fromarray(pixels, "RGBA"))
+    return image, sizes[removed].tolist()
     
 
 
@@ -160,6 +200,28 @@ def collect_border_pixels(image, top=True, bottom=True, left=True, right=True):
     unique_pixel_values = list(set(pixel_values))
 
     return unique_pixel_values
+
+
+def collect_border_positions(image, top=True, bottom=True, left=True, right=True):
+    """
+    Positions of the visible pixels that collect_border_pixels looks at, in the same order.
+
+    :param image: PIL Image in RGBA mode
+    :return: Int array of shape (n, 2) with the (x, y) positions
+    """
+    width, height = image.size
+    border_distance = 2
+    alpha = np.asarray(image)[:, :, 3]
+    xs = np.arange(border_distance, width - border_distance)
+    ys = np.arange(border_distance, height - border_distance)
+
+    rows = [y for y, wanted in ((border_distance, top), (height - border_distance - 1, bottom)) if wanted]
+    columns = [x for x, wanted in ((border_distance, left), (width - border_distance - 1, right)) if wanted]
+    # For every x the top pixel comes before the bottom one, then for every y left before right
+    positions = [np.stack([np.repeat(xs, len(rows)), np.tile(rows, len(xs))], axis=1).reshape(-1, 2),
+                 np.stack([np.tile(columns, len(ys)), np.repeat(ys, len(columns))], axis=1).reshape(-1, 2)]
+    positions = np.concatenate(positions).astype(np.intp)
+    return positions[alpha[positions[:, 1], positions[:, 0]] != 0]
 def obtainblack(image):
     width, height = image.size
     corners = [image.getpixel((2, 2)), 
@@ -177,7 +239,11 @@ def pixel_transparent_checker(pixel):
     else:
         return False
 
-def sweeper(image, black, tolerance, minimumcluster):
+def sweeper(image, black, tolerance, minimumcluster, backend=None):
+    if _numpy_backend(backend):
+        import naive_numpy
+        return naive_numpy.sweeper(image, black, tolerance, minimumcluster)
+
     width, height = image.size
     maxblack = tuple(int(x * (1 + tolerance)) for x in black)
     minblack = tuple(int(x * (1 - tolerance)) for x in black)
@@ -189,14 +255,18 @@ def sweeper(image, black, tolerance, minimumcluster):
             pixel = image.getpixel((x, y))
             if pixel_within_tolerance(pixel, minblack, maxblack):
                 # Check if the cluster is large enough and doesn't border alpha == 0 pixels
-                if miniclusterchecker(image, x, y, black, tolerance, min_size=minimumcluster):
+                if miniclusterchecker(image, x, y, black, tolerance, min_size=minimumcluster, backend="pil"):
                     # Start clustereater if cluster is large enough
-                    image, cluster_size = clustereater(image, x, y, black, tolerance)
+                    image, cluster_size = clustereater(image, x, y, black, tolerance, backend="pil")
                     cluster_sizes.append(cluster_size)
                                 
     return image, cluster_sizes
 
-def miniclusterchecker(image, start_x, start_y, black, tolerance, min_size):
+def miniclusterchecker(image, start_x, start_y, black, tolerance, min_size, backend=None):
+    if _numpy_backend(backend):
+        import naive_numpy
+        return naive_numpy.miniclusterchecker(image, start_x, start_y, black, tolerance, min_size)
+
     maxblack = tuple(int(x * (1 + tolerance)) for x in black)
     minblack = tuple(int(x * (1 - tolerance)) for x in black)
     width, height = image.size
@@ -228,7 +298,11 @@ def miniclusterchecker(image, start_x, start_y, black, tolerance, min_size):
     # Check if the cluster borders any alpha == 0 pixels
     return cluster_size >= min_size 
 
-def clustereater(image, x, y, black, tolerance):
+def clustereater(image, x, y, black, tolerance, backend=None):
+    if _numpy_backend(backend):
+        import naive_numpy
+        return naive_numpy.clustereater(image, x, y, black, tolerance)
+
     clustersize = 1  # Initialize with 1 to count the starting pixel
     maxblack = tuple(int(x * (1 + tolerance)) for x in black)
     minblack = tuple(int(x * (1 - tolerance)) for x in black)
@@ -256,7 +330,11 @@ def clustereater(image, x, y, black, tolerance):
                         
     return image, clustersize
 
-def countvalidpixels(image):
+def countvalidpixels(image, backend=None):
+    if _numpy_backend(backend) or isinstance(image, np.ndarray):
+        import naive_numpy
+        return naive_numpy.countvalidpixels(image)
+
     width, height = image.size
     count = 0
     for x in range(width):
@@ -269,7 +347,11 @@ def countvalidpixels(image):
 
 
 #ONLY FOR DERBIS -  DERELICT
-def debrissweeper(image, min_cluster_size):
+def debrissweeper(image, min_cluster_size, backend=None):
+    if _numpy_backend(backend):
+        import naive_numpy
+        return naive_numpy.debrissweeper(image, min_cluster_size)
+
     width, height = image.size
     visited = set()
     
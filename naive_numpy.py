@@ -0,0 +1,211 @@
+"""
+Array-backed versions of the naive.py flood-fill helpers.
+
+The functions keep the signatures and results of sweeper, miniclusterchecker,
+clustereater, countvalidpixels and debrissweeper in naive.py (8-connectivity,
+column-by-column scan order, neighbours repainted to transparent white), but
+work on NumPy arrays and label every candidate region once instead of
+flood-filling it per pixel.
+Select them with naive.set_backend("numpy").
+"""
+import heapq
+from collections import deque
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+import naive
+from debris import remnanteater
+from hole_engine import tolerance_mask
+
+EIGHT_CONNECTED = np.ones((3, 3), dtype=bool)
+ERASED = (255, 255, 255, 0)  # colour clustereater paints over eaten pixels
+
+
+def tolerance_window(black, tolerance):
+    """
+    Same colour window as the naive helpers, clipped to 0..255 so it fits uint8.
+
+    Clipping does not change which pixels are inside the window.
+
+    :param black: Reference colour, (R, G, B) or (R, G, B, A)
+    :param tolerance: Relative tolerance
+    :return: Tuple of (minblack, maxblack) RGB tuples
+    """
+    maxblack = tuple(min(int(x * (1 + tolerance)), 255) for x in black[:3])
+    minblack = tuple(max(int(x * (1 - tolerance)), 0) for x in black[:3])
+    return minblack, maxblack
+
+
+def needs_reference(image, minblack, maxblack):
+    """
+    Check whether the PIL implementation has to be used instead.
+
+    The naive helpers only handle RGBA images. If the repaint colour itself is
+    inside the tolerance window, repainted pixels rejoin the flood fill and the
+    result depends on visiting order, so those cases are left to the original code.
+    """
+    if image.mode != "RGBA":
+        return True
+    return all(minblack[i] <= ERASED[i] <= maxblack[i] for i in range(3))
+
+
+def reaches_min_size(tolerant, transparent, start_x, start_y, min_size):
+    """
+    Breadth-first search of miniclusterchecker on boolean arrays.
+
+    Visits neighbours in the same order as the PIL version, so it stops at the
+    same pixel and returns the same answer.
+
+    :param tolerant: Boolean array, True where the colour is within tolerance
+    :param transparent: Boolean array, True where alpha == 0
+    :return: True if min_size pixels are reached before a transparent neighbour
+    """
+    height, width = tolerant.shape
+    queue = deque([(start_x, start_y)])
+    visited = {(start_x, start_y)}
+    cluster_size = 0
+
+    while queue and cluster_size < min_size:
+        x, y = queue.popleft()
+        cluster_size += 1
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if dx == 0 and dy == 0:
+                    continue
+                neighbor_x = x + dx
+                neighbor_y = y + dy
+                if 0 <= neighbor_x < width and 0 <= neighbor_y < height and (neighbor_x, neighbor_y) not in visited:
+                    if transparent[neighbor_y, neighbor_x]:
+                        return False
+                    if tolerant[neighbor_y, neighbor_x]:
+                        queue.append((neighbor_x, neighbor_y))
+                        visited.add((neighbor_x, neighbor_y))
+
+    return cluster_size >= min_size
+
+
+def miniclusterchecker(image, start_x, start_y, black, tolerance, min_size):
+    minblack, maxblack = tolerance_window(black, tolerance)
+    if image.mode != "RGBA":
+        return naive.miniclusterchecker(image, start_x, start_y, black, tolerance, min_size, backend="pil")
+
+    # The search never leaves a (2 * min_size + 1) square around the start pixel
+    radius = max(min_size, 0)
+    left, top = max(start_x - radius, 0), max(start_y - radius, 0)
+    right = min(start_x + radius + 1, image.width)
+    bottom = min(start_y + radius + 1, image.height)
+    window = np.array(image.crop((left, top, right, bottom)))
+
+    tolerant = tolerance_mask(window, minblack, maxblack)
+    transparent = window[:, :, 3] == 0
+    return reaches_min_size(tolerant, transparent, start_x - left, start_y - top, min_size)
+
+
+def clustereater(image, x, y, black, tolerance):
+    minblack, maxblack = tolerance_window(black, tolerance)
+    if needs_reference(image, minblack, maxblack):
+        return naive.clustereater(image, x, y, black, tolerance, backend="pil")
+
+    pixels = np.array(image)
+    tolerant = tolerance_mask(pixels, minblack, maxblack)
+    tolerant[y, x] = True  # the start pixel is always eaten
+
+    labels, _ = ndimage.label(tolerant, structure=EIGHT_CONNECTED)
+    cluster = labels == labels[y, x]
+
+    # Every pixel of the cluster and all of its neighbours are repainted
+    pixels[ndimage.binary_dilation(cluster, structure=EIGHT_CONNECTED)] = ERASED
+    image.paste(Image.fromarray(pixels, "RGBA"))
+
+    return image, int(np.count_nonzero(cluster))
+
+
+def countvalidpixels(image):
+    """
+    Count the pixels that are not fully transparent.
+
+    :param image: RGBA PIL Image or uint8 array of shape (height, width, 4)
+    :return: Number of pixels with alpha != 0
+    """
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image if image.mode == "RGBA" else image.convert("RGBA"))
+    return int(np.count_nonzero(image[:, :, 3]))
+
+
+def debrissweeper(image, min_cluster_size):
+    # Same fragments as check_cluster_size (8-connected opaque pixels), all labelled at once
+    pixels = np.array(image)
+    debris = remnanteater(pixels[:, :, 3] != 0, min_cluster_size, keep_largest=False)
+    pixels[debris] = ERASED
+    image.paste(Image.fromarray(pixels, "RGBA"))
+    return image
+
+
+def sweeper(image, black, tolerance, minimumcluster):
+    minblack, maxblack = tolerance_window(black, tolerance)
+    if needs_reference(image, minblack, maxblack):
+        return naive.sweeper(image, black, tolerance, minimumcluster, backend="pil")
+
+    pixels = np.array(image)
+    height, width = pixels.shape[:2]
+    tolerant = tolerance_mask(pixels, minblack, maxblack)
+    transparent = pixels[:, :, 3] == 0
+
+    # Every flood fill of the PIL version stays inside one 8-connected region
+    # of in-tolerance pixels, so the regions can be labelled up front
+    labels, count = ndimage.label(tolerant, structure=EIGHT_CONNECTED)
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+
+    # Regions smaller than the minimum can never pass miniclusterchecker
+    candidate = sizes >= minimumcluster
+    candidate[0] = False
+
+    # Candidate pixels in the order sweeper visits them (column by column),
+    # grouped per region
+    flat_labels = labels.ravel(order="F")
+    positions = np.flatnonzero(candidate[flat_labels])
+    position_labels = flat_labels[positions]
+    grouping = np.argsort(position_labels, kind="stable")
+    positions = positions[grouping]
+    position_labels = position_labels[grouping]
+    group_starts = np.flatnonzero(np.diff(position_labels, prepend=-1))
+    group_ends = np.r_[group_starts[1:], len(positions)]
+
+    objects = ndimage.find_objects(labels)
+    radius = max(minimumcluster, 0)
+
+    # Replay the scan: each region is checked pixel by pixel, in scan order,
+    # until miniclusterchecker passes. Eating a region changes transparency
+    # for the regions after it, so events are processed strictly in scan order.
+    events = [(positions[start], group) for group, start in enumerate(group_starts)]
+    heapq.heapify(events)
+    index = group_starts.copy()
+    cluster_sizes = []
+
+    while events:
+        position, group = heapq.heappop(events)
+        x, y = divmod(int(position), height)
+
+        # Without transparency within reach the search always succeeds
+        window = transparent[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1]
+        if window.any() and not reaches_min_size(tolerant, transparent, x, y, minimumcluster):
+            index[group] += 1
+            if index[group] < group_ends[group]:
+                heapq.heappush(events, (positions[index[group]], group))
+            continue
+
+        # clustereater: erase the region and repaint its neighbours
+        label = position_labels[group_starts[group]]
+        rows, cols = objects[label - 1]
+        rows = slice(max(rows.start - 1, 0), min(rows.stop + 1, height))
+        cols = slice(max(cols.start - 1, 0), min(cols.stop + 1, width))
+        eaten = ndimage.binary_dilation(labels[rows, cols] == label, structure=EIGHT_CONNECTED)
+        pixels[rows, cols][eaten] = ERASED
+        transparent[rows, cols] |= eaten
+        cluster_sizes.append(int(sizes[label]))
+
+    image.paste(Image.fromarray(pixels, "RGBA"))
+    return image, cluster_sizes
+
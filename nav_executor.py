@@ -4,8 +4,7 @@ import PIL
 from PIL import Image
 from naive import obtainblack, sweeper, clustereater, countvalidpixels, debrissweeper
 import torch
-from rembg import remove
-import io
+from removebg import remove_background
 #from display import display
 
 path = 'dataset/onceler.jpeg'
@@ -18,11 +17,7 @@ tolerance = 0.5
 
 maxdebrissize = 50
 ##### remove background with rembg before passing onto the clustereater
-with open(path, 'rb') as i:
-    input = i.read()
-    output = remove(input)
-    pil_image = Image.open(io.BytesIO(output))
-    image = pil_image.convert("RGBA")
+image = remove_background(image)
 
 ##### apply gaussian blur to the image before passing onto the clustereater
 
@@ -0,0 +1,335 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+import instrumentation
+
+from naive import countvalidpixels
+from black_sampler import reference_black
+from debris import remnanteater
+from pore_metrics import measure_pores
+from removebg import foreground_mask, cut_out
+from hole_engine import candidate_mask, label_mask, pack_mask, unpack_mask, edge_distance, interior_from_distance, \
+    HoleSet, block_pyramid, find_holes_pyramid
+
+
+class PorosityPipeline:
+    """
+    Analysis state for one image.
+
+    Every stage keeps its last result together with the parameters it was
+    computed from, and is only re-run when one of those parameters changes.
+    Changing the black tolerance or the minimum cluster size therefore only
+    re-runs the hole classification and labelling, not rembg or the edge distance.
+
+    The image is decoded once into an RGBA array that every stage reads; it is
+    only turned back into a PIL Image for the cleaned result and the debug image.
+
+    Masks are cached bit-packed (1 bit per pixel). The full-size intermediates
+    (decoded image, no-background image, object mask, edge distance) are
+    released once a run has selected the holes, so between runs an image only
+    keeps the packed masks, the HoleSet and the cleaned result. A later run that
+    needs them decodes the image again; rembg's mask then comes from the mask cache.
+
+    Stage dependencies:
+        load, background, object mask,
+        edge distance, pyramid level   -> (image only)
+        interior mask, debug image     -> edge_width
+        black reference                -> edge_samples, black_estimator
+        hole candidates                -> edge_width, edge_samples, black_estimator, black_tolerance
+        pyramid holes                  -> ... + minimum_cluster_size (pyramid mode, instead of hole candidates)
+        holes and stats                -> ... + minimum_cluster_size
+        debris removal                 -> ... + max_debris_size (optional, only changes the image)
+    """
+
+    # Full-size stages released at the end of every run
+    TRANSIENT_STAGES = ("load", "background", "object_mask", "edge_distance")
+
+    def __init__(self, input_path):
+        self.input_path = input_path
+        self._stages = {}
+
+    def _stage(self, name, key, compute):
+        """Return the cached result of a stage, or compute it if its key changed."""
+        cached = self._stages.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with instrumentation.stage(name):
+            value = compute()
+        self._stages[name] = (key, value)
+        return value
+
+    def release(self, names=TRANSIENT_STAGES):
+        """Drop cached stages; they are recomputed when a later run needs them."""
+        for name in names:
+            self._stages.pop(name, None)
+
+    def load(self):
+        # Step 1: Load the image into an RGBA array
+        # (rembg would apply the EXIF orientation, do it here so both arrays line up)
+        def compute():
+            with Image.open(self.input_path) as raw_image:
+                raw_image = ImageOps.exif_transpose(raw_image).convert("RGBA")
+            raw = np.asarray(raw_image)
+            return raw, countvalidpixels(raw)
+        return self._stage("load", (), compute)
+
+    def background(self):
+        # Step 2: Remove background using rembg (reuses the already decoded image)
+        def compute():
+            raw, _ = self.load()
+            _, mask = foreground_mask(raw)
+            no_bg = cut_out(raw, np.asarray(mask))
+            return no_bg, countvalidpixels(no_bg)
+        return self._stage("background", (), compute)
+
+    def object_mask(self):
+        # Step 3: Create a mask of the non-transparent pixels
+        def compute():
+            no_bg, _ = self.background()
+            return no_bg[:, :, 3] > 0
+        return self._stage("object_mask", (), compute)
+
+    def edge_distance(self):
+        # Step 4a: Distance of every object pixel to the object edge, computed once per image
+        return self._stage("edge_distance", (), lambda: edge_distance(self.object_mask()))
+
+    def interior_mask(self, edge_width):
+        # Step 4b: Create an interior mask by thresholding the edge distance
+        # This gives us a "safe zone" that's definitely not edge pixels,
+        # for a new edge width only this comparison is re-run
+        def compute():
+            interior = interior_from_distance(self.edge_distance(), edge_width)
+            return pack_mask(interior), interior.shape
+        packed, shape = self._stage("interior_mask", (edge_width,), compute)
+        return unpack_mask(packed, shape)
+
+    def black_reference(self, edge_samples, estimator="mean"):
+        # Step 5: Scientifically determine the "black" reference value
+        # from the background pixels along the image border (see black_sampler.py)
+        def compute():
+            raw, _ = self.load()
+            no_bg, _ = self.background()
+            return reference_black(raw, no_bg, edge_samples, estimator)
+        return self._stage("black_reference", (edge_samples, estimator), compute)
+
+    def save_debug_image(self, edge_width, debug_path):
+        # Create debug image showing the interior mask (keep this one)
+        def compute():
+            no_bg, _ = self.background()
+            debug = no_bg.copy()
+            # Edge pixels (in the border zone) are coloured red
+            debug[self.object_mask() & ~self.interior_mask(edge_width)] = (255, 0, 0, 255)
+            Image.fromarray(debug, "RGBA").save(debug_path)
+            return debug_path
+        return self._stage("debug_image", (edge_width, debug_path), compute)
+
+    def hole_candidates(self, black_tolerance, edge_width, edge_samples, black_estimator="mean"):
+        # Step 6: Classify the interior pixels against the black tolerance bounds,
+        # kept packed so that a new minimum cluster size only re-runs the labelling
+        def compute():
+            no_bg, _ = self.background()
+            candidates = candidate_mask(no_bg, self.interior_mask(edge_width),
+                                        self.black_reference(edge_samples, black_estimator), black_tolerance)
+            return pack_mask(candidates), candidates.shape
+        key = (black_tolerance, edge_width, edge_samples, black_estimator)
+        packed, shape = self._stage("hole_candidates", key, compute)
+        return unpack_mask(packed, shape)
+
+    def pyramid(self):
+        # Step 6a (pyramid mode): Colour range and edge distance per 4 x 4 block, computed once per image
+        def compute():
+            no_bg, _ = self.background()
+            return block_pyramid(no_bg, self.edge_distance())
+        return self._stage("pyramid", (), compute)
+
+    def pyramid_holes(self, black_tolerance, minimum_cluster_size, edge_width, edge_samples, black_estimator="mean"):
+        # Step 6b (pyramid mode): Classify the blocks first, then label full-resolution pixels only
+        # inside the blocks that may hold a hole; gives the same holes as Step 6 + Step 7
+        def compute():
+            no_bg, _ = self.background()
+            return find_holes_pyramid(no_bg, self.interior_mask(edge_width), self.pyramid(),
+                                      self.black_reference(edge_samples, black_estimator), black_tolerance,
+                                      minimum_cluster_size, edge_width)
+        key = (black_tolerance, minimum_cluster_size, edge_width, edge_samples, black_estimator)
+        return self._stage("pyramid_holes", key, compute)
+
+    def run(self, black_tolerance, minimum_cluster_size, edge_width, edge_samples, debug_path=None,
+            progress=None, black_estimator="mean", remove_debris=False, max_debris_size=None, pyramid=False):
+        """
+        Run the analysis, re-using every stage whose parameters did not change.
+
+        :param progress: Optional callback called with a message before each stage;
+                         it may raise to abort between stages (finished stages stay cached)
+        :param black_estimator: How the border samples are reduced to the reference black,
+                                one of black_sampler.ESTIMATORS
+        :param remove_debris: Clear the opaque specks around the object in the cleaned image
+        :param max_debris_size: Specks with fewer pixels are debris, None to keep only the largest object
+        :param pyramid: Search the holes coarse to fine, faster when only a small part of the object
+                        is porous; the holes and statistics are the same
+        :return: Tuple of (cleaned image, HoleSet, stats dict); with instrumentation enabled
+                 the stats hold the stage records of this run under 'timings'
+        """
+        start = instrumentation.mark()
+        with instrumentation.stage("process_image"):
+            result = self._run(black_tolerance, minimum_cluster_size, edge_width, edge_samples, debug_path,
+                               progress, black_estimator, remove_debris, max_debris_size, pyramid)
+        # The holes are selected, the full-size intermediates are no longer needed
+        self.release()
+        if instrumentation.enabled():
+            cleaned_image, holes, stats = result
+            result = cleaned_image, holes, dict(stats, timings=instrumentation.records(start))
+        return result
+
+    def _run(self, black_tolerance, minimum_cluster_size, edge_width, edge_samples, debug_path, progress,
+             black_estimator, remove_debris, max_debris_size, pyramid):
+        report = progress or (lambda message: None)
+        report("Loading image")
+        self.load()
+        report("Removing background")
+        self.background()
+        report("Building object mask")
+        self.object_mask()
+        report("Building protected edge zone")
+        self.interior_mask(edge_width)
+        report("Determining reference black")
+        self.black_reference(edge_samples, black_estimator)
+        if debug_path:
+            report("Saving debug image")
+            self.save_debug_image(edge_width, debug_path)
+        if pyramid:
+            report("Building pyramid level")
+            self.pyramid()
+            report("Searching holes coarse to fine")
+            self.pyramid_holes(black_tolerance, minimum_cluster_size, edge_width, edge_samples, black_estimator)
+        else:
+            report("Classifying hole candidates")
+            self.hole_candidates(black_tolerance, edge_width, edge_samples, black_estimator)
+        report("Removing holes and computing statistics")
+
+        # Step 7: Detect and remove holes in the interior region only
+        def compute():
+            no_bg, no_bg_size = self.background()
+            _, normal_image_size = self.load()
+            if pyramid:
+                holes = self.pyramid_holes(black_tolerance, minimum_cluster_size, edge_width, edge_samples,
+                                           black_estimator)
+            else:
+                # The label array only lives until the holes are selected
+                labels, sizes = label_mask(self.hole_candidates(black_tolerance, edge_width, edge_samples,
+                                                                black_estimator))
+                holes = HoleSet.from_labels(labels, sizes, minimum_cluster_size)
+                del labels
+
+            cleaned = no_bg.copy()
+            cleaned[holes.mask()] = 0  # Make transparent
+
+            # Calculate statistics
+            stats = summarize(holes.clusters, normal_image_size, no_bg_size, countvalidpixels(cleaned))
+            stats['reference_black'] = self.black_reference(edge_samples, black_estimator)
+            stats['pores'] = measure_pores(holes)
+            return Image.fromarray(cleaned, "RGBA"), holes, stats
+        key = (black_tolerance, minimum_cluster_size, edge_width, edge_samples, black_estimator, pyramid)
+        result = self._stage("holes", key, compute)
+        if not remove_debris:
+            return result
+
+        report("Removing debris")
+
+        # Step 8: Clear the specks around the object, the statistics above are not changed
+        def compute():
+            cleaned_image, holes, stats = result
+            cleaned = np.array(cleaned_image)
+            debris = remnanteater(cleaned[:, :, 3] > 0, max_debris_size)
+            cleaned[debris] = 0
+            return Image.fromarray(cleaned, "RGBA"), holes, dict(stats, debris_pixels=int(np.count_nonzero(debris)))
+        return self._stage("debris", key + (max_debris_size,), compute)
+
+
+def analyze_porosity(input_path, black_tolerance, minimum_cluster_size, edge_width, edge_samples, debug_path=None,
+                     black_estimator="mean", remove_debris=False, max_debris_size=None, pyramid=False):
+    """
+    Process the image using a scientific approach to detect black pixels and ignore edge regions.
+
+    :param input_path: Path of the image to analyse
+    :param black_tolerance: Relative tolerance around the reference black
+    :param minimum_cluster_size: Clusters smaller than this are not considered holes
+    :param edge_width: Width in pixels of the protected zone along the object edge
+    :param edge_samples: Number of edge points to sample for black detection
+    :param debug_path: Where to save the edge zone debug image, None to skip it
+    :param black_estimator: How the border samples are reduced to the reference black,
+                            one of black_sampler.ESTIMATORS
+    :param remove_debris: Clear the opaque specks around the object in the cleaned image
+    :param max_debris_size: Specks with fewer pixels are debris, None to keep only the largest object
+    :param pyramid: Search the holes coarse to fine (see hole_engine.find_holes_pyramid)
+    :return: Tuple of (cleaned image, HoleSet, stats dict)
+    """
+    pipeline = PorosityPipeline(input_path)
+    return pipeline.run(black_tolerance, minimum_cluster_size, edge_width, edge_samples, debug_path,
+                        black_estimator=black_estimator, remove_debris=remove_debris,
+                        max_debris_size=max_debris_size, pyramid=pyramid)
+
+
+def check_results(cleaned_image, clusters, normal_image_size, no_bg_size):
+    """Calculate statistics from processed image"""
+    final_image_size = countvalidpixels(cleaned_image)
+    return summarize(clusters, normal_image_size, no_bg_size, final_image_size)
+
+
+def summarize(clusters, normal_image_size, no_bg_size, final_image_size):
+    """Build the stats dict from the cluster sizes and pixel counts"""
+    # Convert cluster sizes to integers
+    clusters = [int(x) for x in clusters]
+
+    # Calculate statistics
+    density = final_image_size / no_bg_size if no_bg_size > 0 else 1
+    cluster_sum = sum(clusters)
+    avg_cluster_size = sum(clusters) / len(clusters) if clusters else 0
+    cluster_amount = len(clusters)
+
+    stats = {
+        'normal_image_size': normal_image_size,
+        'no_bg_size': no_bg_size,
+        'final_image_size': final_image_size,
+        'cluster_amount': cluster_amount,
+        'clusters': clusters,
+        'cluster_sum': cluster_sum,
+        'avg_cluster_size': avg_cluster_size,
+        'density': density
+    }
+
+    return stats
+
+
+def generate_report(report_path, stats):
+    """Generate analysis report with statistics."""
+    with open(report_path, 'w') as f:
+        f.write("Metal Porosity Analysis Report\n")
+        f.write("=======================\n\n")
+
+        f.write("All numbers here are expressed in terms of pixel count. If provided with an image scale and image size,\n")
+        f.write("one can easily convert these values to meaningful units.\n")
+        f.write("Clusters are the holes within the object itself.\n\n")
+
+        f.write(f"Normal Image Size: {stats['normal_image_size']}\n")
+        f.write(f"Object Size (after bg removal): {stats['no_bg_size']}\n")
+        f.write(f"Final Object Size (after hole removal): {stats['final_image_size']}\n")
+        f.write(f"Cluster Amount: {stats['cluster_amount']}\n")
+        f.write(f"Cluster Sizes: {stats['clusters']}\n")
+        f.write(f"Cluster Sum: {stats['cluster_sum']}\n")
+        f.write(f"Average Cluster Size: {stats['avg_cluster_size']:.2f}\n")
+        f.write(f"Density: {stats['density']:.2%}\n")
+        if 'debris_pixels' in stats:
+            f.write(f"Debris Removed From the Image (not counted above): {stats['debris_pixels']}\n")
+
+        # Per-pore measurements, the full table is in the _pores.csv next to this report
+        pores = stats.get('pores')
+        if pores is not None and len(pores['area']):
+            f.write(f"Mean Equivalent Diameter: {pores['equivalent_diameter'].mean():.2f}\n")
+            f.write(f"Mean Circularity: {pores['circularity'].mean():.3f}\n")
+            f.write(f"Mean Eccentricity: {pores['eccentricity'].mean():.3f}\n")
+
+        # Where the time went, only present when instrumentation is enabled
+        if stats.get('timings'):
+            f.write("\nStage Timings:\n")
+            for line in instrumentation.format_records(stats['timings']):
+                f.write(line + "\n")
@@ -1,18 +1,159 @@
-from rembg import remove
-from PIL import Image
+from rembg import remove, new_session
+from PIL import Image, ImageOps
+import numpy as np
+import threading
 import io
-def remove_background(input: str, save_output: bool = True):
-    imgpath = input
-    input_path = imgpath
+import os
 
-    with open(input_path, 'rb') as i:
+import instrumentation
+from mask_cache import MaskCache
 
+# Model used when no model_name is given, any rembg model name works ("u2net", "isnet-general-use", ...)
+DEFAULT_MODEL = "u2net"
 
+# One rembg session per model, shared by every call in this process
+_sessions = {}
+_sessions_lock = threading.Lock()
 
-        input = i.read()
-        output = remove(input)
-        pil_image = Image.open(io.BytesIO(output))
-        return pil_image
+# Foreground masks already computed, keyed by decoded pixels + model name
+mask_cache = MaskCache()
+
+
+def get_session(model_name=None):
+    """
+    Return the rembg session for a model, creating it on first use.
+
+    Creating a session loads the ONNX model, which is the expensive part of the
+    first remove() call. Later calls reuse the same session.
+
+    :param model_name: rembg model name, defaults to DEFAULT_MODEL
+    :return: rembg session
+    """
+    model_name = model_name or DEFAULT_MODEL
+    with _sessions_lock:
+        session = _sessions.get(model_name)
+        if session is None:
+            session = new_session(model_name)
+            _sessions[model_name] = session
+    return session
+
+
+def warm_up(model_name=None, background=True):
+    """
+    Load the model and run one tiny inference so the first real image only pays for inference.
+
+    :param model_name: rembg model name, defaults to DEFAULT_MODEL
+    :param background: Run in a daemon thread and return immediately
+    :return: The warm-up thread if background is True, otherwise None
+    """
+    def run():
+        session = get_session(model_name)
+        remove(Image.new("RGB", (32, 32)), session=session)
+
+    if background:
+        thread = threading.Thread(target=run, name="rembg-warm-up", daemon=True)
+        thread.start()
+        return thread
+    run()
+    return None
+
+
+def apply_mask(image, mask):
+    """
+    Cut the foreground out of an image the same way rembg does.
+
+    :param image: PIL Image
+    :param mask: PIL Image in "L" mode, 255 = foreground
+    :return: PIL Image in RGBA mode, background fully transparent
+    """
+    empty = Image.new("RGBA", image.size, 0)
+    return Image.composite(image.convert("RGBA"), empty, mask)
+
+
+def cut_out(rgba, mask):
+    """
+    Array version of apply_mask, gives exactly the same pixels.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param mask: uint8 array of shape (height, width), 255 = foreground
+    :return: New uint8 RGBA array, background fully transparent
+    """
+    # PIL blends with DIV255(v * m) = ((t >> 8) + t) >> 8 where t = v * m + 128
+    tmp = rgba.astype(np.uint16) * mask[:, :, None] + 128
+    return (((tmp >> 8) + tmp) >> 8).astype(np.uint8)
+
+
+def _cache_content(input, image):
+    """
+    Bytes the mask cache key is computed from: the decoded pixels as RGBA.
+
+    A path, a PIL Image and an ndarray of the same picture give the same key, so
+    the mask computed for one is reused for the others. An RGBA ndarray is
+    hashed through a memoryview without copying it.
+
+    :param input: The input of foreground_mask
+    :param image: The decoded, EXIF-transposed PIL Image
+    :return: List of bytes-like chunks for MaskCache.key
+    """
+    if isinstance(input, np.ndarray) and input.ndim == 3 and input.shape[2] == 4:
+        pixels = np.ascontiguousarray(input)
+    else:
+        pixels = np.asarray(image if image.mode == "RGBA" else image.convert("RGBA"))
+    return [str(pixels.shape).encode(), memoryview(pixels)]
+
+
+def foreground_mask(input, model_name=None, use_cache=True):
+    """
+    Compute the rembg foreground mask of an image.
+
+    The mask is cached on disk (see mask_cache.py), so the same input with the
+    same model only goes through inference once.
+
+    :param input: Image path, PIL Image or ndarray (H x W x 3 or H x W x 4, uint8)
+    :param model_name: rembg model name, defaults to DEFAULT_MODEL
+    :param use_cache: Look up and store the mask in the mask cache
+    :return: Tuple of (decoded PIL Image, PIL Image in "L" mode with 255 = foreground)
+    """
+    model_name = model_name or DEFAULT_MODEL
+
+    with instrumentation.stage("decode"):
+        if isinstance(input, (str, os.PathLike)):
+            with open(input, 'rb') as i:
+                image = Image.open(io.BytesIO(i.read()))
+        else:
+            image = Image.fromarray(input) if isinstance(input, np.ndarray) else input
+
+        # rembg applies the EXIF orientation itself; doing it here keeps cached
+        # masks aligned with the image they are applied to
+        image = ImageOps.exif_transpose(image)
+
+    with instrumentation.stage("mask_cache_lookup"):
+        key = mask_cache.key(_cache_content(input, image), model_name) if use_cache else None
+        mask = mask_cache.get(key) if key else None
+    if mask is None:
+        with instrumentation.stage("rembg"):
+            mask = remove(image, session=get_session(model_name), only_mask=True)
+        if key:
+            with instrumentation.stage("mask_cache_store"):
+                mask_cache.put(key, mask)
+
+    return image, mask
+
+
+def remove_background(input, save_output: bool = True, model_name=None, use_cache=True):
+    """
+    Remove the background of an image with rembg.
+
+    :param input: Image path, PIL Image or ndarray (H x W x 3 or H x W x 4, uint8)
+    :param save_output: Kept for compatibility, the result is not written to disk
+    :param model_name: rembg model name, defaults to DEFAULT_MODEL
+    :param use_cache: Look up and store the mask in the mask cache
+    :return: PIL Image in RGBA mode with the background made transparent
+    """
+    with instrumentation.stage("remove_background"):
+        image, mask = foreground_mask(input, model_name, use_cache)
+        with instrumentation.stage("apply_mask"):
+            return apply_mask(image, mask)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,205 @@
+"""
+Multi-seed background segmentation for legacy_window.compmain.
+
+compmain used to rescan the border ring with getpixel for a visible pixel,
+flood-fill the background region of that colour (clustereater), sweep the
+whole image for holes of that colour (sweeper), and start over until the ring
+was empty. Here the ring is read once as an array:
+
+1. Seeds are all visible ring pixels, in the order complexblack finds them.
+   The first seed that is not yet eaten starts a region: the 8-connected
+   component of pixels within tolerance of its own colour, found with one
+   labelling. The region and its 8-neighbours are eaten, which usually covers
+   most of the remaining seeds, so only a handful of regions are grown.
+2. Each region colour is swept once, in region order, like sweeper: the
+   pixels within its tolerance window that are not gone yet are labelled, and
+   each component of at least the minimum size is accepted the way sweeper
+   does it. Its pixels are tried in scan order with the bounded search of
+   miniclusterchecker, which fails when it touches an eaten or transparent
+   pixel before reaching the minimum size. Accepted holes are gone for the
+   components and colours after them.
+
+Unlike repeated clustereater calls, eaten pixels never rejoin a later region,
+even if the erase colour lies inside its tolerance window. All regions are
+grown before the first sweep, so a sweep also treats the regions grown after
+its colour as gone.
+"""
+import heapq
+
+import numpy as np
+from scipy import ndimage
+
+from hole_engine import tolerance_mask
+from naive_numpy import EIGHT_CONNECTED, ERASED, reaches_min_size, tolerance_window
+
+BORDER_DISTANCE = 2  # seeds are taken from the ring this many pixels inside the border, as in complexblack
+
+
+def border_seeds(rgba, border_distance=BORDER_DISTANCE):
+    """
+    Visible pixels on the ring that naive.complexblack scans, in its scan order.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param border_distance: Distance of the ring from the image border
+    :return: Tuple of (ys, xs) index arrays
+    """
+    height, width = rgba.shape[:2]
+    d = border_distance
+    xs = np.arange(d, width - d)
+    ys = np.arange(d, height - d)
+    # complexblack alternates top / bottom for every x, then left / right for every y
+    ring_ys = np.concatenate([np.stack([np.full(len(xs), d), np.full(len(xs), height - d - 1)], axis=1).ravel(),
+                              np.repeat(ys, 2)])
+    ring_xs = np.concatenate([np.repeat(xs, 2),
+                              np.stack([np.full(len(ys), d), np.full(len(ys), width - d - 1)], axis=1).ravel()])
+    visible = rgba[ring_ys, ring_xs, 3] != 0
+    return ring_ys[visible], ring_xs[visible]
+
+
+def grow_regions(rgba, tolerance, border_distance=BORDER_DISTANCE):
+    """
+    Grow the background regions from the border seeds.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param tolerance: Relative colour tolerance around each seed colour
+    :param border_distance: Distance of the seed ring from the image border
+    :return: Tuple of (boolean background mask, boolean eaten mask (background and its
+             8-neighbours), list of seed colours that started a region, list of region sizes)
+    """
+    height, width = rgba.shape[:2]
+    seed_ys, seed_xs = border_seeds(rgba, border_distance)
+    background = np.zeros((height, width), dtype=bool)
+    eaten = np.zeros((height, width), dtype=bool)
+    colours, sizes = [], []
+
+    remaining = np.arange(len(seed_ys))
+    while len(remaining):
+        y, x = seed_ys[remaining[0]], seed_xs[remaining[0]]
+        colour = tuple(int(v) for v in rgba[y, x, :3])
+        minblack, maxblack = tolerance_window(colour, tolerance)
+
+        inside = tolerance_mask(rgba, minblack, maxblack)
+        inside &= ~eaten
+        inside[y, x] = True  # the seed always belongs to its own region
+        labels, _ = ndimage.label(inside, structure=EIGHT_CONNECTED)
+        region = labels == labels[y, x]
+
+        background |= region
+        eaten |= ndimage.binary_dilation(region, structure=EIGHT_CONNECTED)
+        colours.append(colour)
+        sizes.append(int(np.count_nonzero(region)))
+
+        # Seeds inside the eaten area are gone, the next visible one starts the next region
+        remaining = remaining[~eaten[seed_ys[remaining], seed_xs[remaining]]]
+
+    return background, eaten, colours, sizes
+
+
+def sweep_colour(rgba, gone, colour, tolerance, minimum_cluster_size):
+    """
+    Find the holes of one region colour, like one sweeper call.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param gone: Boolean mask of the eaten and transparent pixels, the eaten holes
+                 and their 8-neighbours are added to it
+    :param colour: Region colour from grow_regions
+    :param tolerance: Relative colour tolerance
+    :param minimum_cluster_size: Smaller components are not holes
+    :return: Tuple of (boolean hole mask, list of hole sizes in the order sweeper eats them)
+    """
+    candidates = tolerance_mask(rgba, *tolerance_window(colour, tolerance))
+    candidates &= ~gone
+
+    labels, count = ndimage.label(candidates, structure=EIGHT_CONNECTED)
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    height, width = labels.shape
+
+    # Components smaller than the minimum can never pass miniclusterchecker
+    is_candidate = sizes >= minimum_cluster_size
+    is_candidate[0] = False
+
+    # Candidate pixels in the order sweeper visits them (column by column), grouped per component
+    flat_labels = labels.ravel(order="F")
+    positions = np.flatnonzero(is_candidate[flat_labels])
+    position_labels = flat_labels[positions]
+    grouping = np.argsort(position_labels, kind="stable")
+    positions = positions[grouping]
+    position_labels = position_labels[grouping]
+    group_starts = np.flatnonzero(np.diff(position_labels, prepend=-1))
+    group_ends = np.r_[group_starts[1:], len(positions)]
+
+    objects = ndimage.find_objects(labels)
+    radius = max(minimum_cluster_size, 0)
+
+    # Replay the scan like naive_numpy.sweeper: each component is checked pixel by
+    # pixel until the bounded search reaches the minimum size before touching a
+    # gone pixel. Eating a hole makes its neighbours gone for the components
+    # after it, so the checks run strictly in scan order.
+    events = [(positions[start], group) for group, start in enumerate(group_starts)]
+    heapq.heapify(events)
+    index = group_starts.copy()
+    hole_labels = []
+
+    while events:
+        position, group = heapq.heappop(events)
+        x, y = divmod(int(position), height)
+
+        # Without gone pixels within reach the search always succeeds
+        window = gone[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1]
+        if window.any() and not reaches_min_size(candidates, gone, x, y, minimum_cluster_size):
+            index[group] += 1
+            if index[group] < group_ends[group]:
+                heapq.heappush(events, (positions[index[group]], group))
+            continue
+
+        label = position_labels[group_starts[group]]
+        hole_labels.append(label)
+        rows, cols = objects[label - 1]
+        rows = slice(max(rows.start - 1, 0), min(rows.stop + 1, height))
+        cols = slice(max(cols.start - 1, 0), min(cols.stop + 1, width))
+        gone[rows, cols] |= ndimage.binary_dilation(labels[rows, cols] == label, structure=EIGHT_CONNECTED)
+
+    is_hole = np.zeros(count + 1, dtype=bool)
+    is_hole[hole_labels] = True
+    return is_hole[labels], sizes[hole_labels].tolist()
+
+
+def sweep_holes(rgba, eaten, colours, tolerance, minimum_cluster_size):
+    """
+    Find the holes of every region colour, one sweep per colour in region order.
+
+    :param rgba: uint8 array of shape (height, width, 4)
+    :param eaten: Boolean mask of the eaten background, from grow_regions
+    :param colours: Region colours from grow_regions
+    :param tolerance: Relative colour tolerance
+    :param minimum_cluster_size: Smaller components are not holes
+    :return: Tuple of (boolean hole mask, list of hole sizes, colour by colour in sweep order)
+    """
+    gone = eaten | (rgba[:, :, 3] == 0)
+    holes = np.zeros(rgba.shape[:2], dtype=bool)
+    hole_sizes = []
+    for colour in colours:
+        colour_holes, sizes = sweep_colour(rgba, gone, colour, tolerance, minimum_cluster_size)
+        holes |= colour_holes
+        hole_sizes += sizes
+    return holes, hole_sizes
+
+
+def segment(rgba, tolerance, minimum_cluster_size, border_distance=BORDER_DISTANCE):
+    """
+    Remove the background reachable from the border ring and the holes of the same colours, in place.
+
+    :param rgba: uint8 array of shape (height, width, 4), eaten pixels are painted in the
+                 erase colour of clustereater
+    :param tolerance: Relative colour tolerance around each seed colour
+    :param minimum_cluster_size: Minimum hole size in pixels
+    :param border_distance: Distance of the seed ring from the image border
+    :return: Tuple of (background pixel count, list of hole sizes in sweep order)
+    """
+    background, eaten, colours, _ = grow_regions(rgba, tolerance, border_distance)
+    holes, hole_sizes = sweep_holes(rgba, eaten, colours, tolerance, minimum_cluster_size)
+
+    # Holes are eaten with their 8-neighbours too
+    eaten |= ndimage.binary_dilation(holes, structure=EIGHT_CONNECTED)
+    rgba[eaten] = ERASED
+    return int(np.count_nonzero(background)), hole_sizes
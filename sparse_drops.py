@@ -5,6 +5,14 @@ import numpy as np
 from scipy.ndimage import binary_dilation
 import os
 
+from background_job import BackgroundJob
+from debris import remnanteater
+from histogram_thresholds import auto_thresholds, brightness, row_chunks
+from particle_stats import PARTICLE_CONNECTIVITY, particle_statistics, write_reports
+import instrumentation
+
+MINIMUM_PARTICLE_SIZE = 10  # pixels, smaller particles are counted as debris
+
 class BackgroundRemoverGUI:
     def __init__(self, root):
         self.root = root
@@ -51,6 +59,9 @@ class BackgroundRemoverGUI:
         self.slider_label = ttk.Label(slider_frame, text="35")
         self.slider_label.pack(side=tk.LEFT, padx=10)
         
+        self.auto_button = ttk.Button(main_frame, text="Auto", command=self.auto_aggressiveness)
+        self.auto_button.grid(row=3, column=2, padx=5, pady=5)
+        
         ttk.Label(main_frame, text="(Higher = more background removed)", 
                  font=('Arial', 8, 'italic')).grid(row=4, column=1, sticky=tk.W, padx=5)
         
@@ -70,20 +81,75 @@ class BackgroundRemoverGUI:
         ttk.Label(main_frame, text="(Removes pure black + this tolerance)", 
                  font=('Arial', 8, 'italic')).grid(row=6, column=1, sticky=tk.W, padx=5)
         
+        # Debris removal
+        self.remove_debris = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text=f"Remove debris (particles smaller than {MINIMUM_PARTICLE_SIZE} pixels)",
+                        variable=self.remove_debris).grid(row=7, column=1, sticky=tk.W, padx=5, pady=5)
+        
         # Separator
-        ttk.Separator(main_frame, orient='horizontal').grid(row=7, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=20)
+        ttk.Separator(main_frame, orient='horizontal').grid(row=8, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=20)
         
-        # Start Button
-        self.start_button = ttk.Button(main_frame, text="Start", command=self.process_image)
-        self.start_button.grid(row=8, column=1, pady=10)
+        # Start / Cancel Buttons
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=9, column=1, pady=10)
+        self.start_button = ttk.Button(button_frame, text="Start", command=self.process_image)
+        self.start_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel, state='disabled')
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        self.job = None
         
         # Status Label
         self.status_label = ttk.Label(main_frame, text="Ready", foreground="blue")
-        self.status_label.grid(row=9, column=0, columnspan=3, pady=5)
+        self.status_label.grid(row=10, column=0, columnspan=3, pady=5)
         
     def update_slider_label(self, value):
         self.slider_label.config(text=str(int(float(value))))
     
+    def auto_aggressiveness(self):
+        """Set the slider to the value picked from the brightness histogram of the input image."""
+        input_file = self.input_path.get()
+        if not input_file or not os.path.exists(input_file):
+            messagebox.showerror("Error", "Input file does not exist!")
+            return
+        
+        self.status_label.config(text="Reading histograms...", foreground="orange")
+        self.start_button.config(state='disabled')
+        self.auto_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
+        
+        def finished():
+            self.start_button.config(state='normal')
+            self.auto_button.config(state='normal')
+            self.cancel_button.config(state='disabled')
+        
+        def work(job):
+            job.progress("Loading image...")
+            img_array = load_image(input_file)
+            job.progress("Reading histograms...")
+            return auto_thresholds(img_array)
+        
+        def done(thresholds):
+            finished()
+            value = min(100, max(10, thresholds["aggressiveness"]))
+            self.aggressiveness.set(value)
+            self.update_slider_label(value)
+            self.status_label.config(text=f"Background colour {thresholds['base_black']}, "
+                                          f"aggressiveness {value}", foreground="blue")
+        
+        def error(e):
+            finished()
+            self.status_label.config(text=f"Error: {str(e)}", foreground="red")
+        
+        def cancelled():
+            finished()
+            self.status_label.config(text="Cancelled", foreground="blue")
+        
+        # Decoding a large image takes seconds, so it runs on a worker thread like Start
+        self.job = BackgroundJob(
+            self.root, work,
+            on_progress=lambda message: self.status_label.config(text=message, foreground="orange"),
+            on_done=done, on_error=error, on_cancelled=cancelled).start()
+    
     def update_tolerance_label(self, value):
         self.tolerance_label.config(text=str(int(float(value))))
     
@@ -109,6 +175,7 @@ class BackgroundRemoverGUI:
         output_file = self.output_path.get()
         aggressiveness = self.aggressiveness.get()
         black_tol = self.black_tolerance.get()
+        remove_debris = self.remove_debris.get()
         
         # Validation
         if not input_file or not os.path.exists(input_file):
@@ -119,83 +186,204 @@ class BackgroundRemoverGUI:
             messagebox.showerror("Error", "Please specify an output path!")
             return
         
+        # Particle report next to the output image: output/name.png -> output/name_report.txt
+        report_path = os.path.splitext(output_file)[0] + "_report.txt"
+        
         # Update status
         self.status_label.config(text="Processing...", foreground="orange")
         self.start_button.config(state='disabled')
-        self.root.update()
+        self.auto_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
         
-        try:
-            # Load the image
-            img = Image.open(input_file)
-            
-            # Convert to RGBA if not already
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            # Convert to numpy array
-            img_array = np.array(img)
-            height, width = img_array.shape[:2]
-            
-            # Step 1: Sample 4x4 pixels in top-left corner for base black value
-            top_left_sample = img_array[0:4, 0:4, :3]
-            base_black = np.mean(top_left_sample, axis=(0, 1))
-            
-            # Step 2: Define black spectrum with aggressiveness threshold
-            max_background = base_black + aggressiveness
-            
-            # Step 3: Additional check for pure black pixels with tolerance
-            # Pure black = RGB values all close to 0
-            pure_black_mask = np.all(img_array[:, :, :3] <= black_tol, axis=2)
-            
-            # Step 4: Find the white overlay box (bottom-right area)
-            brightness = np.sum(img_array[:, :, :3], axis=2)
-            brightness_threshold = np.percentile(brightness, 95)
-            bright_mask = brightness >= brightness_threshold
-            
-            # Expand the mask to ensure we capture the entire box including text
-            bright_mask_expanded = binary_dilation(bright_mask, iterations=5)
-            
-            # Step 5: Create mask for black spectrum
-            black_spectrum_mask = np.all(img_array[:, :, :3] <= max_background, axis=2)
-            
-            # Combine both masks: regular black spectrum OR pure black
-            combined_black_mask = black_spectrum_mask | pure_black_mask
-            
-            # Step 6: Remove black pixels EXCEPT those in overlay
-            pixels_to_remove = combined_black_mask & ~bright_mask_expanded
-            
-            # Set alpha to 0 for these pixels
-            img_array[pixels_to_remove, 3] = 0
-            
-            # Convert back to PIL Image
-            result_img = Image.fromarray(img_array)
-            
-            # Create output directory if it doesn't exist
-            output_dir = os.path.dirname(output_file)
-            if output_dir and not os.path.exists(output_dir):
-                os.makedirs(output_dir, exist_ok=True)
-            
-            # Save the result
-            result_img.save(output_file)
-            
+        def finished():
+            self.start_button.config(state='normal')
+            self.auto_button.config(state='normal')
+            self.cancel_button.config(state='disabled')
+        
+        def done(result):
+            finished()
             # Statistics
-            total_pixels = height * width
-            removed_pixels = np.sum(pixels_to_remove)
+            removed_pixels, total_pixels, stats = result
             percentage = (removed_pixels / total_pixels) * 100
             
             self.status_label.config(
-                text=f"Success! Removed {removed_pixels:,} pixels ({percentage:.1f}%)",
+                text=f"Success! Removed {removed_pixels:,} pixels ({percentage:.1f}%), "
+                     f"{stats['particle_count']:,} particles",
                 foreground="green"
             )
             messagebox.showinfo("Success", f"Image saved to:\n{output_file}\n\n"
-                                          f"Removed {removed_pixels:,} background pixels ({percentage:.1f}%)")
-            
-        except Exception as e:
+                                          f"Removed {removed_pixels:,} background pixels ({percentage:.1f}%)\n"
+                                          f"Particles: {stats['particle_count']:,}, coverage {stats['coverage']:.1%}\n"
+                                          f"Report saved to:\n{report_path}")
+        
+        def error(e):
+            finished()
             self.status_label.config(text=f"Error: {str(e)}", foreground="red")
             messagebox.showerror("Error", f"An error occurred:\n{str(e)}")
         
-        finally:
-            self.start_button.config(state='normal')
+        def cancelled():
+            finished()
+            self.status_label.config(text="Cancelled", foreground="blue")
+        
+        # Run on a worker thread so the window stays responsive
+        self.job = BackgroundJob(
+            self.root,
+            lambda job: remove_background_pixels(input_file, output_file, aggressiveness, black_tol, job.progress,
+                                                 report_path, remove_debris=remove_debris),
+            on_progress=lambda message: self.status_label.config(text=message, foreground="orange"),
+            on_done=done, on_error=error, on_cancelled=cancelled).start()
+    
+    def cancel(self):
+        if self.job:
+            self.job.cancel()
+
+
+def remove_background_pixels(input_file, output_file, aggressiveness, black_tol, progress=None,
+                             report_path=None, minimum_particle_size=MINIMUM_PARTICLE_SIZE, remove_debris=False):
+    """
+    Make the dark background between scattered particles transparent and save the result.
+
+    :param input_file: Path of the input image
+    :param output_file: Path of the output image, its directory is created if needed
+    :param aggressiveness: How far above the base black a pixel may be to count as background,
+                           None to pick it from the brightness histogram
+    :param black_tol: Pixels with all channels <= this are removed as pure black
+    :param progress: Optional callback called with a message before each stage
+    :param report_path: If given, count the particles and write the particle report there
+                        (plus _particles.csv and .json next to it, see particle_stats)
+    :param minimum_particle_size: Smaller particles are not counted (debris)
+    :param remove_debris: Also make the fragments smaller than minimum_particle_size transparent,
+                          after the particles were counted
+    :return: Tuple of (removed pixel count, total pixel count, particle stats dict or None)
+    """
+    with instrumentation.ProgressStages("sparse_drops", progress) as report:
+        return _remove_background_pixels(input_file, output_file, aggressiveness, black_tol, report,
+                                         report_path, minimum_particle_size, remove_debris)
+
+
+def _remove_background_pixels(input_file, output_file, aggressiveness, black_tol, report,
+                              report_path, minimum_particle_size, remove_debris):
+    report("Loading image...")
+    img_array = load_image(input_file)
+    height, width = img_array.shape[:2]
+    
+    report("Building background mask...")
+    thresholds = auto_thresholds(img_array)
+    if aggressiveness is None:
+        aggressiveness = thresholds["aggressiveness"]
+    pixels_to_remove = background_mask(img_array, aggressiveness, black_tol, thresholds)
+    
+    stats = None
+    if report_path:
+        report("Counting particles...")
+        stats = particle_statistics(~pixels_to_remove & (img_array[:, :, 3] > 0), minimum_particle_size)
+    
+    if remove_debris:
+        report("Removing debris...")
+        pixels_to_remove |= debris_mask(img_array, pixels_to_remove, minimum_particle_size)
+    
+    report("Saving image...")
+    save_cutout(img_array, pixels_to_remove, output_file)
+    
+    if report_path:
+        parameters = {'aggressiveness': aggressiveness, 'black_tolerance': black_tol,
+                      'minimum_particle_size': minimum_particle_size, 'remove_debris': remove_debris}
+        write_reports(report_path, stats, parameters, tool="sparse_drops", source=input_file)
+    
+    return int(np.sum(pixels_to_remove)), height * width, stats
+
+
+def load_image(input_file):
+    """
+    Load an image as an RGBA array.
+
+    :param input_file: Path of the image
+    :return: uint8 array of shape (height, width, 4)
+    """
+    img = Image.open(input_file)
+    
+    # Convert to RGBA if not already
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    
+    return np.array(img)
+
+
+def background_mask(img_array, aggressiveness, black_tol, thresholds=None):
+    """
+    Find the dark background between the particles.
+
+    :param img_array: uint8 RGBA array
+    :param aggressiveness: How far above the base black a pixel may be to count as background,
+                           None to use the automatic value (see histogram_thresholds)
+    :param black_tol: Pixels with all channels <= this are removed as pure black
+    :param thresholds: Result of histogram_thresholds.auto_thresholds if already computed
+    :return: Boolean array, True for the pixels to make transparent
+    """
+    # Step 1: Base black and overlay brightness from the colour histograms
+    if thresholds is None:
+        thresholds = auto_thresholds(img_array)
+    if aggressiveness is None:
+        aggressiveness = thresholds["aggressiveness"]
+    
+    # Step 2: Define black spectrum with aggressiveness threshold; the channels are
+    # integers, so comparing with the rounded down limit is the same
+    max_background = np.clip(np.floor(np.add(thresholds["base_black"], aggressiveness)), 0, 255).astype(np.uint8)
+    
+    height, width = img_array.shape[:2]
+    combined_black_mask = np.empty((height, width), dtype=bool)
+    bright_mask = np.empty((height, width), dtype=bool)
+    for rows in row_chunks(height, width):
+        rgb = img_array[rows, :, :3]
+        
+        # Step 3: Black spectrum OR pure black (all RGB values close to 0)
+        combined_black_mask[rows] = np.all(rgb <= max_background, axis=2) | np.all(rgb <= black_tol, axis=2)
+        
+        # Step 4: Find the white overlay box (bottom-right area)
+        bright_mask[rows] = brightness(rgb) >= thresholds["overlay_brightness"]
+    
+    # Expand the mask to ensure we capture the entire box including text
+    bright_mask_expanded = binary_dilation(bright_mask, iterations=5)
+    
+    # Step 5: Remove black pixels EXCEPT those in overlay
+    return combined_black_mask & ~bright_mask_expanded
+
+
+def debris_mask(img_array, mask, minimum_particle_size=MINIMUM_PARTICLE_SIZE):
+    """
+    Fragments left by the background mask that are too small to be particles.
+
+    :param img_array: RGBA array
+    :param mask: Boolean background mask from background_mask
+    :param minimum_particle_size: Fragments with fewer pixels are debris, grouped like the particles
+                                  of particle_stats (4-connected)
+    :return: Boolean array, True on the debris pixels
+    """
+    return remnanteater(~mask & (img_array[:, :, 3] > 0), minimum_particle_size, keep_largest=False,
+                        structure=PARTICLE_CONNECTIVITY)
+
+
+def save_cutout(img_array, mask, output_file, **save_options):
+    """
+    Make the masked pixels transparent and save the image.
+
+    :param img_array: uint8 RGBA array, its alpha channel is changed in place
+    :param mask: Boolean array of the pixels to make transparent
+    :param output_file: Path of the output image, its directory is created if needed
+    :param save_options: Passed on to PIL's Image.save (e.g. compress_level for PNG)
+    """
+    # Set alpha to 0 for these pixels
+    img_array[mask, 3] = 0
+    
+    # Convert back to PIL Image
+    result_img = Image.fromarray(img_array)
+    
+    # Create output directory if it doesn't exist
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    
+    result_img.save(output_file, **save_options)
 
 if __name__ == "__main__":
     root = tk.Tk()
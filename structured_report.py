@@ -0,0 +1,157 @@
+"""
+Machine-readable analysis reports.
+
+Next to the text report every tool writes a small JSON file with all scalar
+statistics, the parameters, the reference black and a binned cluster-size
+histogram. The per-cluster arrays (cluster sizes, the pore table) go into a
+sidecar .npz (or .parquet when pyarrow is installed and asked for) so the
+JSON stays small and thousands of reports load without parsing text:
+
+    report = load_report("output/report.json")
+    report["stats"]["density"], report["arrays"]["clusters"]
+"""
+import json
+import os
+
+import numpy as np
+
+SCHEMA_VERSION = 1
+ARRAY_FORMATS = ("npz", "parquet", "none")
+
+
+def json_report_path(report_path):
+    """JSON path next to a text report: output/report.txt -> output/report.json"""
+    return os.path.splitext(report_path)[0] + ".json"
+
+
+def size_histogram(sizes):
+    """
+    Histogram of cluster sizes in power-of-two bins.
+
+    :param sizes: Cluster sizes in pixels
+    :return: Dict with "edges" (1, 2, 4, ..., bin i is edges[i] <= size < edges[i + 1]) and "counts"
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    largest = int(sizes.max()) if len(sizes) else 1
+    edges = 2 ** np.arange(int(np.log2(max(largest, 1))) + 2, dtype=np.int64)
+    counts, _ = np.histogram(sizes, bins=edges)
+    return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def _to_json(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def split_stats(stats):
+    """
+    Separate the scalar statistics from the per-cluster arrays.
+
+    :param stats: Stats dict as from porosity_pipeline.summarize, may hold a 'pores' table
+    :return: Tuple of (scalars dict, arrays dict of name -> 1-D numpy array)
+    """
+    scalars, arrays = {}, {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            for column, values in value.items():
+                arrays[f"{key}.{column}"] = np.asarray(values)
+        elif isinstance(value, (list, np.ndarray)):
+            arrays[key] = np.asarray(value)
+        else:
+            scalars[key] = value
+    return scalars, arrays
+
+
+def write_arrays(path, arrays, array_format):
+    """Write the per-cluster arrays as .npz, or as one .parquet table (all arrays must have the same length)."""
+    if array_format == "npz":
+        np.savez_compressed(path, **arrays)
+        return
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Writing .parquet reports needs pyarrow (pip install pyarrow)") from None
+    lengths = {len(values) for values in arrays.values()}
+    if len(lengths) > 1:
+        raise ValueError("Parquet reports need arrays of equal length, use npz instead")
+    pyarrow.parquet.write_table(pyarrow.table(arrays), path)
+
+
+def write_report(json_path, stats, parameters=None, reference_black=None, tool=None, source=None,
+                 array_format="npz"):
+    """
+    Write a structured report.
+
+    :param json_path: Output .json file, the arrays go next to it with the same name
+    :param stats: Stats dict; scalars and stage timings go into the JSON, lists, arrays and tables into the sidecar
+    :param parameters: Dict of the analysis parameters
+    :param reference_black: Reference (R, G, B) colour, None if the tool has none
+    :param tool: Name of the program that produced the report
+    :param source: Path of the analysed image
+    :param array_format: "npz", "parquet", or "none" to keep the arrays inside the JSON
+    :return: Path of the array sidecar, or None
+    """
+    if array_format not in ARRAY_FORMATS:
+        raise ValueError(f"Unknown array format: {array_format}, expected one of {ARRAY_FORMATS}")
+    stats = dict(stats)
+    timings = stats.pop('timings', None)
+    scalars, arrays = split_stats(stats)
+    if reference_black is None:
+        reference_black = scalars.pop('reference_black', None)
+    else:
+        scalars.pop('reference_black', None)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "tool": tool,
+        "source": source,
+        "parameters": parameters or {},
+        "reference_black": list(reference_black) if reference_black is not None else None,
+        "stats": scalars,
+        "size_histogram": size_histogram(arrays.get("clusters", [])),
+    }
+    if timings:
+        report["timings"] = timings
+
+    arrays_path = None
+    if array_format == "none":
+        report["arrays"] = arrays
+    elif arrays:
+        arrays_path = os.path.splitext(json_path)[0] + "." + array_format
+        write_arrays(arrays_path, arrays, array_format)
+        report["arrays_file"] = os.path.basename(arrays_path)
+
+    with open(json_path, 'w') as f:
+        json.dump(report, f, default=_to_json)
+    return arrays_path
+
+
+def load_report(json_path, load_arrays=True):
+    """
+    Read a structured report.
+
+    :param json_path: Report .json file
+    :param load_arrays: Also load the array sidecar into report["arrays"]
+    :return: Report dict
+    """
+    with open(json_path) as f:
+        report = json.load(f)
+
+    if "arrays" in report:
+        report["arrays"] = {name: np.asarray(values) for name, values in report["arrays"].items()}
+    elif load_arrays and report.get("arrays_file"):
+        path = os.path.join(os.path.dirname(json_path), report["arrays_file"])
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                report["arrays"] = {name: data[name] for name in data.files}
+        else:
+            import pyarrow.parquet
+            table = pyarrow.parquet.read_table(path)
+            report["arrays"] = {name: table.column(name).to_numpy() for name in table.column_names}
+    return report
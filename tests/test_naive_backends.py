@@ -0,0 +1,91 @@
+"""
+The numpy backend of the naive helpers against the per-pixel PIL code.
+
+Both backends run the same flow on the same image and must report the same
+cluster sizes and leave the same alpha channel: the nav_executor flow
+(obtainblack, clustereater at (3, 3), one sweeper) on the sample images, and
+both that flow and the compmain border-seed loop on small random images with
+transparent pixels.
+"""
+import glob
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import naive
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = sorted(glob.glob(os.path.join(ROOT, "dataset", "*.jpeg")))
+RANDOM_IMAGES = 50
+
+
+def run_flow(image, backend, tolerance, minimumcluster, seeds):
+    """
+    :param seeds: "corner" for the nav_executor flow, "border" for the compmain loop
+                  (complexblack, clustereater and sweeper until the ring is empty)
+    :return: Tuple of (list of background and cluster sizes, alpha channel)
+    """
+    image = image.copy()
+    sizes = []
+    if seeds == "corner":
+        black = naive.obtainblack(image)
+        image, background = naive.clustereater(image, 3, 3, black, tolerance, backend=backend)
+        image, clustersizes = naive.sweeper(image, black, tolerance, minimumcluster, backend=backend)
+        sizes += [background] + clustersizes
+    else:
+        while naive.complexblack(image) != False:
+            black, pixel = naive.complexblack(image)
+            image, background = naive.clustereater(image, pixel[0], pixel[1], black, tolerance, backend=backend)
+            image, clustersizes = naive.sweeper(image, black, tolerance, minimumcluster, backend=backend)
+            sizes += [background] + clustersizes
+    return sizes, np.array(image)[:, :, 3]
+
+
+def assert_backends_equal(image, tolerance, minimumcluster, seeds):
+    pil_sizes, pil_alpha = run_flow(image, "pil", tolerance, minimumcluster, seeds)
+    np_sizes, np_alpha = run_flow(image, "numpy", tolerance, minimumcluster, seeds)
+    assert np_sizes == pil_sizes
+    assert np.array_equal(np_alpha, pil_alpha)
+
+
+def random_image(seed, width=40, height=30):
+    """
+    A background colour with dark blobs of several sizes, noise, and transparent
+    pixels scattered over it and sometimes over part of the border ring.
+    """
+    rng = np.random.default_rng(seed)
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[:, :, :3] = rng.integers(0, 256, 3)
+    pixels[:, :, 3] = 255
+    dark = rng.integers(0, 80, 3)
+    for _ in range(rng.integers(2, 8)):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        radius = rng.integers(1, 7)
+        pixels[max(y - radius, 0):y + radius, max(x - radius, 0):x + radius, :3] = dark
+    pixels[:, :, :3] = np.clip(pixels[:, :, :3] + rng.integers(-20, 21, (height, width, 3)), 0, 255)
+    pixels[rng.random((height, width)) < rng.uniform(0, 0.05), 3] = 0
+    if rng.random() < 0.5:
+        # complexblack has to skip the transparent part of the ring
+        pixels[:rng.integers(1, 5), :rng.integers(1, width), 3] = 0
+    tolerance = float(rng.choice([0.1, 0.3, 0.5, 0.9]))
+    minimumcluster = int(rng.integers(1, 20))
+    return Image.fromarray(pixels, "RGBA"), tolerance, minimumcluster
+
+
+@pytest.mark.parametrize("path", PATHS, ids=os.path.basename)
+def test_sample_images(path):
+    assert_backends_equal(Image.open(path).convert("RGBA"), 0.5, 30, "corner")
+
+
+@pytest.mark.parametrize("seeds", ["corner", "border"])
+@pytest.mark.parametrize("seed", range(RANDOM_IMAGES))
+def test_random_images(seed, seeds):
+    image, tolerance, minimumcluster = random_image(seed)
+    assert_backends_equal(image, tolerance, minimumcluster, seeds)
+
+
+def test_random_images_have_transparency():
+    # The cases above only cover miniclusterchecker failing if transparency occurs
+    assert any((np.array(random_image(seed)[0])[:, :, 3] == 0).any() for seed in range(RANDOM_IMAGES))
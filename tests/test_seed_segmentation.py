@@ -0,0 +1,60 @@
+"""
+seed_segmentation against the naive sweeper it replaces in compmain.
+
+Every region colour is swept with naive.sweeper on the image with the grown
+background erased, one colour after the other like compmain, and compared
+with sweep_holes. Colours whose tolerance window contains the erase colour
+let erased pixels rejoin sweeper's flood fill; sweep_holes never does that,
+so those cases are skipped.
+"""
+import glob
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+from scipy import ndimage
+
+import naive
+from naive_numpy import EIGHT_CONNECTED, ERASED, tolerance_window
+from seed_segmentation import grow_regions, sweep_holes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = sorted(glob.glob(os.path.join(ROOT, "dataset", "*")))
+SIZE = (400, 300)
+MINIMUM_CLUSTER_SIZE = 30
+
+
+def erase_rejoins(colour, tolerance):
+    minblack, maxblack = tolerance_window(colour, tolerance)
+    return all(minblack[i] <= ERASED[i] <= maxblack[i] for i in range(3))
+
+
+@pytest.mark.parametrize("tolerance", [0.1, 0.3, 0.5])
+@pytest.mark.parametrize("path", PATHS, ids=os.path.basename)
+def test_sweep_holes_matches_sweeper_per_colour(path, tolerance):
+    pixels = np.array(Image.open(path).convert("RGBA").resize(SIZE))
+    _, eaten, colours, _ = grow_regions(pixels, tolerance)
+    if any(erase_rejoins(colour, tolerance) for colour in colours):
+        pytest.skip("erased pixels rejoin sweeper's flood fill")
+    erased = pixels.copy()
+    erased[eaten] = ERASED
+
+    reference = Image.fromarray(erased, "RGBA")
+    reference_sizes = []
+    for colour in colours:
+        reference, sizes = naive.sweeper(reference, colour, tolerance, MINIMUM_CLUSTER_SIZE)
+        reference_sizes += sizes
+
+    holes, hole_sizes = sweep_holes(erased, eaten, colours, tolerance, MINIMUM_CLUSTER_SIZE)
+    erased[ndimage.binary_dilation(holes, structure=EIGHT_CONNECTED)] = ERASED
+
+    assert hole_sizes == reference_sizes
+    assert np.array_equal(erased[:, :, 3], np.array(reference)[:, :, 3])
+
+
+def test_several_colours_are_swept():
+    # The comparison above is only meaningful if some image grows more than one region
+    pixels = np.array(Image.open(os.path.join(ROOT, "dataset", "onceler.jpeg")).convert("RGBA").resize(SIZE))
+    _, _, colours, _ = grow_regions(pixels, 0.1)
+    assert len(colours) > 1
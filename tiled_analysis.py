@@ -0,0 +1,321 @@
+"""
+Out-of-core porosity analysis for very large (stitched) micrographs.
+
+The image is read tile by tile from a memory-mapped source (.npy, or an
+uncompressed TIFF when tifffile is installed). Each tile is read with a halo of
+edge_width pixels so the edge distance of the object mask is exact, its hole
+candidates are labelled, and components crossing tile borders are merged
+afterwards, so cluster sizes match the whole-image analysis. Peak memory is
+bounded by memory_budget_mb instead of the image size. Sources that cannot be
+read tile by tile (compressed TIFFs, PNG, JPEG) are only accepted if the whole
+decoded image fits into the budget.
+
+Components that are too small to be holes and do not touch the tile border are
+dropped per tile, so the per-label records (about 30 bytes each) only grow with
+the number of holes and of components crossing tile borders.
+
+Without a mask_path, the rembg mask is computed on a downscaled overview of the
+image and interpolated bilinearly per tile, then thresholded at half opacity.
+The object boundary is smooth, but it is only as accurate as the overview: on
+a 30k image one overview pixel covers about 30 image pixels, so edge detail
+below that scale is lost. Pass a full-resolution mask_path where that matters.
+"""
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from black_sampler import border_sample_points, estimate_black, corner_points, corner_black
+from hole_engine import tolerance_bounds, tolerance_mask, edge_distance, interior_from_distance, first_pixels
+from porosity_pipeline import summarize
+from removebg import foreground_mask, cut_out
+
+# Rough working set per pixel of a tile including its halo: raw and cut-out RGBA,
+# mask and its float32 interpolation, object/interior/candidate masks, distance
+# transform scratch (int32 feature indices, float64 distances) and int32 labels
+BYTES_PER_PIXEL = 48
+OVERVIEW_SIZE = 1024  # longest side of the overview image fed to rembg
+MASK_THRESHOLD = 128  # interpolated overview mask values from here on are foreground
+
+
+def open_source(path, memory_budget_mb=None):
+    """
+    Open an image for tiled reading without loading it, where the format allows it.
+
+    :param path: .npy array (H x W x C, uint8), TIFF, or any format PIL can read
+    :param memory_budget_mb: Formats that have to be decoded completely are refused
+                             if the decoded image does not fit into this budget
+    :return: Array-like of shape (H, W) or (H, W, C)
+    :raises ValueError: If the image would have to be decoded completely and is over the budget
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r')
+    if ext in ('.tif', '.tiff'):
+        try:
+            import tifffile
+        except ImportError:
+            tifffile = None
+        if tifffile is not None:
+            try:
+                return tifffile.memmap(path, mode='r')
+            except ValueError:
+                # Compressed or tiled TIFFs cannot be mapped
+                with tifffile.TiffFile(path) as tif:
+                    series = tif.series[0]
+                    check_decoded_size(path, int(np.prod(series.shape)) * series.dtype.itemsize,
+                                       memory_budget_mb)
+                return tifffile.imread(path)
+    # Formats without random access have to be decoded completely
+    with Image.open(path) as image:
+        check_decoded_size(path, image.width * image.height * len(image.getbands()), memory_budget_mb)
+        return np.asarray(image)
+
+
+def check_decoded_size(path, nbytes, memory_budget_mb):
+    """Refuse to decode a whole image that does not fit into the memory budget."""
+    if memory_budget_mb is not None and nbytes > memory_budget_mb * 1024 * 1024:
+        raise ValueError(f"{path} cannot be read tile by tile and needs {nbytes / 1024 / 1024:.0f} MB decoded, "
+                         f"more than the {memory_budget_mb} MB budget; convert it to an uncompressed TIFF or .npy")
+
+
+def to_rgba(region):
+    """Convert an (h, w), (h, w, 3) or (h, w, 4) uint8 region to RGBA."""
+    region = np.asarray(region)
+    if region.dtype != np.uint8:
+        raise ValueError(f"Expected an 8-bit image, got {region.dtype}")
+    if region.ndim == 2:
+        region = region[:, :, None]
+    if region.shape[2] == 4:
+        return np.ascontiguousarray(region)
+    rgba = np.empty(region.shape[:2] + (4,), dtype=np.uint8)
+    rgba[:, :, :3] = region[:, :, :3] if region.shape[2] >= 3 else region[:, :, :1]
+    rgba[:, :, 3] = 255
+    return rgba
+
+
+class OverviewMask:
+    """rembg mask computed on a downscaled overview, interpolated to full resolution per region."""
+
+    def __init__(self, source, model_name=None, size=OVERVIEW_SIZE):
+        self.height, self.width = source.shape[:2]
+        step = max(1, -(-max(self.height, self.width) // size))
+        overview = to_rgba(source[::step, ::step])
+        _, mask = foreground_mask(overview, model_name)
+        self.mask = np.asarray(mask, dtype=np.float32)
+
+    def coordinates(self, positions, length, overview_length):
+        """Overview pixels on both sides of each image position, and the weight of the second one."""
+        # Pixel centres line up, like PIL's bilinear resize
+        position = np.clip((positions + 0.5) * overview_length / length - 0.5, 0, overview_length - 1)
+        low = np.floor(position).astype(np.intp)
+        high = np.minimum(low + 1, overview_length - 1)
+        return low, high, (position - low).astype(np.float32)
+
+    def region(self, y0, y1, x0, x1):
+        top, bottom, wy = self.coordinates(np.arange(y0, y1), self.height, self.mask.shape[0])
+        left, right, wx = self.coordinates(np.arange(x0, x1), self.width, self.mask.shape[1])
+        rows = self.mask[top] * (1 - wy)[:, None] + self.mask[bottom] * wy[:, None]
+        values = rows[:, left] * (1 - wx) + rows[:, right] * wx
+        return np.where(values >= MASK_THRESHOLD, np.uint8(255), np.uint8(0))
+
+    def points(self, ys, xs):
+        top, bottom, wy = self.coordinates(np.asarray(ys), self.height, self.mask.shape[0])
+        left, right, wx = self.coordinates(np.asarray(xs), self.width, self.mask.shape[1])
+        values = ((self.mask[top, left] * (1 - wx) + self.mask[top, right] * wx) * (1 - wy)
+                  + (self.mask[bottom, left] * (1 - wx) + self.mask[bottom, right] * wx) * wy)
+        return np.where(values >= MASK_THRESHOLD, np.uint8(255), np.uint8(0))
+
+
+class ArrayMask:
+    """Precomputed full-resolution mask (e.g. a memory-mapped .npy of the alpha channel)."""
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    def region(self, y0, y1, x0, x1):
+        return np.asarray(self.mask[y0:y1, x0:x1], dtype=np.uint8)
+
+    def points(self, ys, xs):
+        return np.asarray(self.mask[ys, xs], dtype=np.uint8)
+
+
+def tile_size(memory_budget_mb, halo):
+    """Largest tile side (without halo) whose working set fits the memory budget."""
+    side = int((memory_budget_mb * 1024 * 1024 / BYTES_PER_PIXEL) ** 0.5) - 2 * halo
+    return max(side, 64)
+
+
+def edge_black(source, mask, edge_samples, estimator="mean"):
+    """
+    Reference black from the border band, same samples and estimators as PorosityPipeline.black_reference.
+
+    :return: (R, G, B) tuple, or the four-corner average if no background sample was found
+    """
+    height, width = source.shape[:2]
+    ys, xs = border_sample_points(height, width, edge_samples)
+    raw = to_rgba(source[ys, xs][None])[0]
+    alpha = cut_out(raw[:, None], mask.points(ys, xs)[:, None])[:, 0, 3]
+
+    # Visible in the original, removed by rembg: true background
+    background = (raw[:, 3] > 0) & (alpha == 0)
+    if background.any():
+        return estimate_black(raw[background, :3], estimator)
+    return corner_black(to_rgba(source[corner_points(height, width)][None])[0])
+
+
+def analyze_tiled(input_path, black_tolerance, minimum_cluster_size, edge_width, edge_samples,
+                  output_path=None, mask_path=None, memory_budget_mb=512, model_name=None, progress=None,
+                  black_estimator="mean"):
+    """
+    Porosity analysis of a large image in tiles.
+
+    :param input_path: Image to analyse, see open_source
+    :param black_tolerance: Relative tolerance around the reference black
+    :param minimum_cluster_size: Clusters smaller than this are not considered holes
+    :param edge_width: Width in pixels of the protected zone along the object edge
+    :param edge_samples: Number of edge points to sample for black detection
+    :param output_path: Where to write the cleaned RGBA image (.npy, or .tif with tifffile), None to skip
+    :param mask_path: Optional .npy foreground mask (H x W, uint8) to use instead of rembg
+    :param memory_budget_mb: Working memory for one tile; the per-label records (about 30 bytes per
+                             hole and per component crossing a tile border) come on top
+    :param model_name: rembg model name, defaults to removebg.DEFAULT_MODEL
+    :param progress: Optional callback called with a message before each stage
+    :param black_estimator: How the border samples are reduced to the reference black,
+                            one of black_sampler.ESTIMATORS
+    :return: Tuple of (stats dict as from check_results, reference black)
+    """
+    report = progress or (lambda message: None)
+    source = open_source(input_path, memory_budget_mb)
+    height, width = source.shape[:2]
+
+    report("Computing foreground mask")
+    mask = ArrayMask(np.load(mask_path, mmap_mode='r')) if mask_path else OverviewMask(source, model_name)
+
+    report("Determining reference black")
+    black = edge_black(source, mask, edge_samples, black_estimator)
+    minblack, maxblack = tolerance_bounds(black, black_tolerance)
+
+    tile = tile_size(memory_budget_mb, edge_width)
+    halo = edge_width
+    tiles = [(y0, min(y0 + tile, height), x0, min(x0 + tile, width))
+             for y0 in range(0, height, tile) for x0 in range(0, width, tile)]
+
+    label_dtype = np.int32 if height * width < 2 ** 31 else np.int64
+    with tempfile.TemporaryDirectory() as scratch:
+        # Global labels of every tile live on disk, not in memory
+        labels_map = np.lib.format.open_memmap(os.path.join(scratch, 'labels.npy'), mode='w+',
+                                               dtype=label_dtype, shape=(height, width))
+        sizes = [np.zeros(1, dtype=np.int64)]  # index 0 = background
+        firsts = [np.zeros(1, dtype=np.int64)]
+        edges = []
+        offset = 0
+        normal_image_size = 0
+        no_bg_size = 0
+
+        # Pass 1: label every tile and record which labels touch across tile borders
+        for number, (y0, y1, x0, x1) in enumerate(tiles, start=1):
+            report(f"Labelling tile {number}/{len(tiles)}")
+            hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, height)
+            hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, width)
+            core = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+
+            raw = to_rgba(source[hy0:hy1, hx0:hx1])
+            no_bg = cut_out(raw, mask.region(hy0, hy1, hx0, hx1))
+            object_mask = no_bg[:, :, 3] > 0
+
+            # Any background pixel closer than edge_width lies inside the halo, so the
+            # distance is exact wherever it decides the interior mask. edge_distance
+            # treats everything outside the halo window as background, which is
+            # further than edge_width away from the tile core.
+            interior = interior_from_distance(edge_distance(object_mask)[core], edge_width)
+
+            normal_image_size += int(np.count_nonzero(raw[core][:, :, 3]))
+            no_bg_size += int(np.count_nonzero(object_mask[core]))
+
+            candidates = tolerance_mask(no_bg[core], minblack, maxblack)
+            candidates &= interior
+            candidates &= object_mask[core]
+            labels, count = ndimage.label(candidates)
+
+            # Components below the minimum size that do not reach the tile border can
+            # never grow into a hole, drop them so the records only hold possible holes
+            tile_sizes = np.bincount(labels.ravel(), minlength=count + 1)
+            kept = tile_sizes >= minimum_cluster_size
+            kept[np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]])] = True
+            kept[0] = False
+            count = int(np.count_nonzero(kept))
+            renumber = np.zeros(len(kept), dtype=labels.dtype)
+            renumber[kept] = np.arange(1, count + 1, dtype=labels.dtype)
+            tile_sizes = tile_sizes[kept]
+            labels = renumber[labels]
+
+            rows, cols = np.divmod(first_pixels(labels, count), x1 - x0)
+            sizes.append(tile_sizes)
+            firsts.append((rows + y0) * width + (cols + x0))
+
+            labels = labels.astype(label_dtype)
+            labels[labels > 0] += offset
+            offset += count
+
+            # Merge with the tiles above and to the left (already written)
+            if y0 > 0:
+                above, below = labels_map[y0 - 1, x0:x1], labels[0]
+                touching = (above > 0) & (below > 0)
+                edges.append(np.stack([above[touching], below[touching]]))
+            if x0 > 0:
+                left, right = labels_map[y0:y1, x0 - 1], labels[:, 0]
+                touching = (left > 0) & (right > 0)
+                edges.append(np.stack([left[touching], right[touching]]))
+
+            labels_map[y0:y1, x0:x1] = labels
+
+        # Components across tiles: union of all touching labels
+        report("Merging clusters across tiles")
+        sizes = np.concatenate(sizes)
+        firsts = np.concatenate(firsts)
+        edges = np.concatenate(edges, axis=1) if edges else np.zeros((2, 0), dtype=np.int64)
+        graph = coo_matrix((np.ones(edges.shape[1], dtype=np.int8), (edges[0], edges[1])),
+                           shape=(offset + 1, offset + 1))
+        _, component = connected_components(graph, directed=False)
+
+        component_sizes = np.bincount(component, weights=sizes).astype(np.int64)
+        component_first = np.full(len(component_sizes), np.iinfo(np.int64).max)
+        np.minimum.at(component_first, component[1:], firsts[1:])
+
+        keep_component = component_sizes >= minimum_cluster_size
+        keep_component[component[0]] = False
+        keep = keep_component[component]
+
+        # Same order as the whole-image analysis: raster order of the first pixel
+        holes = np.flatnonzero(keep_component)
+        clusters = component_sizes[holes[np.argsort(component_first[holes])]].tolist()
+
+        # Pass 2: write the cleaned image
+        if output_path:
+            output = create_output(output_path, (height, width, 4))
+            for number, (y0, y1, x0, x1) in enumerate(tiles, start=1):
+                report(f"Writing tile {number}/{len(tiles)}")
+                no_bg = cut_out(to_rgba(source[y0:y1, x0:x1]), mask.region(y0, y1, x0, x1))
+                no_bg[keep[labels_map[y0:y1, x0:x1]]] = 0  # Make transparent
+                output[y0:y1, x0:x1] = no_bg
+            output.flush()
+            del output
+
+        del labels_map
+
+    stats = summarize(clusters, normal_image_size, no_bg_size, no_bg_size - sum(clusters))
+    stats['reference_black'] = black
+    return stats, black
+
+
+def create_output(path, shape):
+    """Writable memory-mapped output: .npy, or an uncompressed TIFF if tifffile is installed."""
+    if os.path.splitext(path)[1].lower() in ('.tif', '.tiff'):
+        import tifffile
+        return tifffile.memmap(path, shape=shape, dtype=np.uint8, photometric='rgb', extrasamples=['unassalpha'])
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)